@@ -0,0 +1,425 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import full_code
+
+############################################## Helpers ##############################################
+# Time a function and return (seconds, result)
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - started, result
+
+# Value below which the given fraction of the sorted samples fall (nearest rank)
+def percentile(sorted_samples, fraction):
+    return sorted_samples[min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))]
+
+############################################## Data Generator ##############################################
+# Deterministic synthetic data for the three-table schema: the same seed always produces the
+# same school, so runs against different versions of the code are comparable.
+FIRST_NAMES = ("Mohammed", "Ahmad", "Sara", "Lina", "Omar", "Yousef", "Rana", "Huda", "Khaled", "Noor",
+               "Ali", "Maryam", "Hassan", "Layla", "Kareem", "Dana", "Samir", "Aya", "Tariq", "Reem")
+LAST_NAMES = ("Itair", "Haddad", "Khalil", "Nasser", "Saleh", "Mansour", "Awad", "Qasem", "Hamdan", "Yasin",
+              "Darwish", "Barakat", "Odeh", "Jaber", "Shami", "Zaid", "Najjar", "Aziz", "Farah", "Hijazi")
+LESSON_SUBJECTS = ("Math", "Biology", "Chemistry", "Physics", "History", "Geography", "Arabic", "English",
+                   "Art", "Music", "Sports", "Computer Science")
+
+# Student rows (id, first_name, last_name, age, grade, enrollement_date, data_entry_date) with
+# valid ages (5-19), grades (1-12) and dates, as the day numbers they are stored as
+def generate_students(count, seed=0, first_id=1):
+    rng = random.Random(seed)
+    first_day = date(2015, 1, 1)
+    for id in range(first_id, first_id + count):
+        grade = rng.randint(1, 12)
+        age = min(19, grade + 5 + rng.randint(0, 2))
+        enrolled = first_day + timedelta(days=rng.randrange(3650))
+        entered = enrolled + timedelta(days=rng.randrange(30))
+        yield (id, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), age, grade, full_code.day_number(enrolled), full_code.day_number(entered))
+
+# Unique lesson names such as "Math 3"
+def generate_lessons(count):
+    for number in range(count):
+        yield (f"{LESSON_SUBJECTS[number % len(LESSON_SUBJECTS)]} {number // len(LESSON_SUBJECTS) + 1}",)
+
+# Exactly `enrollments` distinct (student_id, lesson_id) pairs spread evenly over the students
+def generate_enrollments(students, lessons, enrollments, seed=0):
+    if enrollments > students * lessons:
+        raise ValueError(f"Cannot create {enrollments} enrollments with {students} students and {lessons} lessons.")
+    rng = random.Random(seed + 1)
+    per_student, extra = divmod(enrollments, students)
+    lesson_ids = range(1, lessons + 1)
+    for student_id in range(1, students + 1):
+        for lesson_id in rng.sample(lesson_ids, per_student + (1 if student_id <= extra else 0)):
+            yield (student_id, lesson_id)
+
+# Fill an empty database with students 1..students, lessons 1..lessons and the enrollments,
+# writing batch_size rows per transaction so memory use stays flat at any size
+def generate_school(conn, students, lessons, enrollments, seed=0, batch_size=10000):
+    if students < 1 or lessons < 1:
+        raise ValueError("The generator needs at least one student and one lesson.")
+    if enrollments > students * lessons:
+        raise ValueError(f"Cannot create {enrollments} enrollments with {students} students and {lessons} lessons.")
+    if conn.execute("SELECT EXISTS (SELECT 1 FROM students) OR EXISTS (SELECT 1 FROM lessons)").fetchone()[0]:
+        raise ValueError("The generator needs an empty database.")
+
+    def write(query, rows):
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                return
+            with conn:
+                conn.executemany(query, batch)
+
+    write("INSERT INTO lessons (name) VALUES (?)", generate_lessons(lessons))
+    write("INSERT INTO students (id, first_name, last_name, age, grade, enrollement_date, data_entry_date) VALUES (?, ?, ?, ?, ?, ?, ?)",
+          generate_students(students, seed))
+    write("INSERT INTO student_lessons (student_id, lesson_id) VALUES (?, ?)",
+          generate_enrollments(students, lessons, enrollments, seed))
+
+############################################## Connection Profiles ##############################################
+# Insert rows one per commit, the way add_student writes them
+def insert_one_per_commit(conn, rows):
+    for row in rows:
+        conn.execute("INSERT INTO students (id, first_name, last_name, age, grade, enrollement_date, data_entry_date) VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+        conn.commit()
+
+# Insert all rows with executemany in a single transaction, the way the bulk importer writes them
+def insert_batched(conn, rows):
+    with conn:
+        conn.executemany("INSERT INTO students (id, first_name, last_name, age, grade, enrollement_date, data_entry_date) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+# Look every student up by ID, the way display_student reads them
+def read_by_id(conn, count):
+    for id in range(1, count + 1):
+        conn.execute("SELECT * FROM students WHERE id = ?", (id,)).fetchone()
+
+# Measure insert and read throughput of every connection profile on a fresh database
+def benchmark_profiles(rows, batched_rows):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in full_code.CONNECTION_PROFILES:
+            full_code.configure_database(os.path.join(directory, f"{profile}.db"), profile)
+            full_code.create_tables()
+            conn = full_code.get_connection()
+
+            single_seconds, _ = timed(insert_one_per_commit, conn, list(generate_students(rows)))
+            conn.execute("DELETE FROM students")
+            conn.commit()
+            batched_seconds, _ = timed(insert_batched, conn, list(generate_students(batched_rows)))
+            read_seconds, _ = timed(read_by_id, conn, batched_rows)
+            scan_seconds, scanned = timed(lambda: sum(1 for _ in full_code.iter_students(conn)))
+            full_code.close_connection()
+
+            results.append((profile, rows / single_seconds, batched_rows / batched_seconds,
+                            batched_rows / read_seconds, scanned / scan_seconds))
+    return results
+
+def print_profile_results(results):
+    print(f"{'profile':<8} {'insert+commit/s':>16} {'batched insert/s':>17} {'point reads/s':>14} {'paged scan/s':>13}")
+    for profile, single, batched, reads, scan in results:
+        print(f"{profile:<8} {single:>16,.0f} {batched:>17,.0f} {reads:>14,.0f} {scan:>13,.0f}")
+
+############################################## Reports ##############################################
+# Average time of every report on the live tables and on the summary tables
+def benchmark_reports(enrollments, repeat, lessons_per_student=5, lessons=20):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        full_code.configure_database(os.path.join(directory, "reports.db"), "bulk")
+        full_code.create_tables()
+        conn = full_code.get_connection()
+        students = max(1, enrollments // lessons_per_student)
+        load_seconds, _ = timed(generate_school, conn, students, lessons, min(enrollments, students * lessons))
+        for name in full_code.REPORTS:
+            # One untimed run before each path warms the page cache (and resets the previous statement)
+            list(full_code.run_report(conn, name, live=True))
+            live_seconds, _ = timed(lambda: [list(full_code.run_report(conn, name, live=True)) for _ in range(repeat)])
+            list(full_code.run_report(conn, name))
+            materialized_seconds, _ = timed(lambda: [list(full_code.run_report(conn, name)) for _ in range(repeat)])
+            results.append((name, live_seconds / repeat, materialized_seconds / repeat))
+        full_code.close_connection()
+    return load_seconds, results
+
+def print_report_results(load_seconds, results):
+    print(f"loading took {load_seconds:.1f}s (summary tables maintained by triggers)")
+    print(f"{'report':<8} {'live ms':>10} {'materialized ms':>16} {'speedup':>8}")
+    for name, live, materialized in results:
+        print(f"{name:<8} {live * 1000:>10.2f} {materialized * 1000:>16.3f} {live / materialized:>7.0f}x")
+
+############################################## CRUD Operations ##############################################
+# Call operation(argument) for every argument and return the latency of each call in seconds.
+# setup(argument) runs untimed before each call.
+def measure(operation, arguments, setup=None):
+    latencies = []
+    for argument in arguments:
+        if setup is not None:
+            setup(argument)
+        started = time.perf_counter()
+        operation(argument)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+# Time the data-access functions behind the menu entries, `samples` calls each, on a generated
+# school of `size` students with three enrollments per student. Reads run first; the writes
+# and deletes run last because they change the data.
+def benchmark_crud(size, samples, seed=0, lessons=50):
+    rng = random.Random(seed)
+    ids = [rng.randint(1, size) for _ in range(samples)]
+    results = []
+
+    def run(name, operation, arguments, setup=None):
+        latencies = sorted(measure(operation, arguments, setup))
+        if latencies:
+            total = sum(latencies)
+            results.append({"size": size, "operation": name, "samples": len(latencies),
+                            "p50_ms": percentile(latencies, 0.50) * 1000,
+                            "p99_ms": percentile(latencies, 0.99) * 1000,
+                            "ops_per_sec": len(latencies) / total if total else 0.0})
+
+    with tempfile.TemporaryDirectory() as directory:
+        full_code.configure_database(os.path.join(directory, "crud.db"), full_code.DEFAULT_PROFILE)
+        full_code.create_tables()
+        conn = full_code.get_connection()
+        generate_school(conn, size, lessons, min(3 * size, size * lessons), seed)
+        conn.execute("ANALYZE")
+        full_code.profile_cache.clear()
+        new_students = [{"id": id, "first_name": first_name, "last_name": last_name, "age": age, "grade": grade,
+                         "enrollement_date": full_code.day_to_date(enrolled)}
+                        for id, first_name, last_name, age, grade, enrolled, _ in generate_students(samples, seed + 2, first_id=size + 1)]
+        searches = [f"{rng.choice(LAST_NAMES)[:3]} {rng.choice(FIRST_NAMES)[:2]}" for _ in range(samples)]
+
+        run("list_students (first page)", lambda _: full_code.fetch_students_page(conn), ids)
+        run("list_students (page after id)", lambda id: full_code.fetch_students_page(conn, id), ids)
+        run("display_student", lambda id: full_code.get_student_profile(conn, id), ids,
+            setup=lambda _: full_code.profile_cache.clear())
+        run("display_student (cached)", lambda id: full_code.get_student_profile(conn, id), ids,
+            setup=lambda id: full_code.get_student_profile(conn, id))
+        run("search_students", lambda text: full_code.search_students(conn, text), searches)
+        run("display_lessons", lambda _: full_code.fetch_lessons(conn), ids)
+        run("add_student", lambda record: full_code.insert_student(conn, record), new_students)
+        run("modify_student", lambda id: full_code.update_student(conn, id, {"grade": 1 + id % 12}), ids)
+        run("assign_lessons", lambda id: full_code.enroll_student(conn, id, [1 + id % lessons]), ids)
+        run("delete_student", lambda id: full_code.remove_student(conn, id), rng.sample(range(1, size + 1), min(samples, size)))
+        run("delete_lesson", lambda id: full_code.remove_lesson(conn, id), rng.sample(range(1, lessons + 1), min(samples, lessons // 2)))
+        full_code.close_connection()
+    return results
+
+def print_crud_results(results):
+    print(f"{'size':>9} {'operation':<30} {'samples':>7} {'p50 ms':>9} {'p99 ms':>9} {'ops/s':>10}")
+    for result in results:
+        print(f"{result['size']:>9} {result['operation']:<30} {result['samples']:>7} "
+              f"{result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} {result['ops_per_sec']:>10,.0f}")
+
+# Store results together with what produced them, so two files can be compared later
+def save_crud_results(path, results, seed, samples):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({"created": datetime.now().isoformat(timespec="seconds"),
+                   "python_version": platform.python_version(),
+                   "sqlite_version": sqlite3.sqlite_version,
+                   "seed": seed,
+                   "samples": samples,
+                   "results": results}, file, indent=2)
+
+# Operations whose p50 latency grew by more than threshold (0.2 = 20%) compared with an
+# earlier results file, as (result, baseline_result) pairs
+def find_regressions(results, baseline, threshold):
+    previous = {(result["size"], result["operation"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get((result["size"], result["operation"]))
+        if old is not None and result["p50_ms"] > old["p50_ms"] * (1 + threshold):
+            regressions.append((result, old))
+    return regressions
+
+############################################## Backup ##############################################
+# Step sizes compared by the backup suite: (pages per step, seconds of sleep between steps)
+BACKUP_CONFIGURATIONS = [(-1, 0), (full_code.DEFAULT_BACKUP_PAGES, 0), (64, 0.001)]
+
+# Commit one-row updates on a connection of its own until stop is set, recording the latency
+# of every commit; commits that fail because the database stayed locked are counted separately
+def keep_writing(path, profile, students, stop, latencies, failures):
+    conn = full_code.connect(path, profile)
+    id = 0
+    while not stop.is_set():
+        id = id % students + 1
+        started = time.perf_counter()
+        try:
+            conn.execute("UPDATE students SET grade = grade % 12 + 1 WHERE id = ?", (id,))
+            conn.commit()
+            latencies.append(time.perf_counter() - started)
+        except sqlite3.OperationalError:
+            conn.rollback()
+            failures.append(time.perf_counter() - started)
+    conn.close()
+
+# Run function while a writer thread commits in the background. Returns (result, latencies, failures).
+def with_writer(path, profile, students, function, *args):
+    stop = threading.Event()
+    latencies, failures = [], []
+    writer = threading.Thread(target=keep_writing, args=(path, profile, students, stop, latencies, failures))
+    writer.start()
+    try:
+        result = function(*args)
+    finally:
+        stop.set()
+        writer.join()
+    return result, sorted(latencies), failures
+
+# Copy rate of backup_database and the commit latency of a concurrent writer, for every step
+# configuration in the WAL ('fast') and rollback-journal ('safe') profiles
+def benchmark_backup(students):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "backup.db")
+        full_code.configure_database(path, "bulk")
+        full_code.create_tables()
+        generate_school(full_code.get_connection(), students, 50, 3 * students)
+        full_code.close_connection()
+
+        for profile in ("fast", "safe"):
+            full_code.configure_database(path, profile)
+            conn = full_code.get_connection()
+            # Commit latency of the writer on its own, for comparison
+            _, idle, _ = with_writer(path, profile, students, time.sleep, 0.5)
+            # Without WAL, backup_database always copies everything in one step
+            for pages, sleep in BACKUP_CONFIGURATIONS if profile == "fast" else [(-1, 0)]:
+                destination = os.path.join(directory, "copy.db")
+                result, busy, failures = with_writer(path, profile, students, full_code.backup_database, conn, destination, pages, sleep)
+                results.append({
+                    "profile": profile, "pages": pages, "sleep": sleep, "seconds": result["seconds"],
+                    "mb_per_sec": result["bytes"] / result["seconds"] / 1e6,
+                    "idle_p99_ms": percentile(idle, 0.99) * 1000 if idle else 0.0,
+                    "commits": len(busy), "failed": len(failures),
+                    "p99_ms": percentile(busy, 0.99) * 1000 if busy else 0.0,
+                    "max_stall_ms": max(busy + failures, default=0.0) * 1000,
+                })
+            full_code.close_connection()
+    return results
+
+def print_backup_results(results):
+    print(f"{'profile':<8} {'pages':>6} {'sleep s':>8} {'backup s':>9} {'MB/s':>8} {'commits':>8} {'failed':>7} "
+          f"{'idle p99 ms':>12} {'p99 ms':>8} {'max stall ms':>13}")
+    for result in results:
+        print(f"{result['profile']:<8} {result['pages']:>6} {result['sleep']:>8} {result['seconds']:>9.2f} {result['mb_per_sec']:>8.0f} "
+              f"{result['commits']:>8} {result['failed']:>7} {result['idle_p99_ms']:>12.2f} {result['p99_ms']:>8.2f} {result['max_stall_ms']:>13.1f}")
+
+############################################## Federated Queries ##############################################
+# Time every federated operation over `schools` copies of a generated school, once scanning the
+# files one after another in this process and once with the process pool at each worker count
+def benchmark_federated(schools, students, worker_counts):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        first = os.path.join(directory, "school_0.db")
+        full_code.configure_database(first, "bulk")
+        full_code.create_tables()
+        generate_school(full_code.get_connection(), students, 50, 3 * students)
+        full_code.close_connection()
+        paths = [first]
+        for number in range(1, schools):
+            paths.append(os.path.join(directory, f"school_{number}.db"))
+            shutil.copyfile(first, paths[-1])
+
+        for operation, argument in (("count", None), ("find", students // 2), ("enrollments", None), ("list", None)):
+            sequential, rows = timed(lambda: sum(len(full_code.run_federated_operation(path, operation, argument)[1]) for path in paths))
+            for workers in worker_counts:
+                parallel, _ = timed(lambda: sum(1 for _ in full_code.federated_query(paths, operation, argument, workers)))
+                results.append((operation, rows, workers, sequential, parallel))
+    return results
+
+def print_federated_results(results):
+    print(f"{'operation':<12} {'rows':>9} {'workers':>8} {'sequential s':>13} {'parallel s':>11} {'speedup':>8}")
+    for operation, rows, workers, sequential, parallel in results:
+        print(f"{operation:<12} {rows:>9} {workers:>8} {sequential:>13.3f} {parallel:>11.3f} {sequential / parallel:>7.1f}x")
+
+################################################## MAIN ##################################################
+SUITES = ("profiles", "reports", "crud", "backup", "federated")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="School Database benchmarks and synthetic data generator")
+    parser.add_argument("suites", nargs="*", help=f"benchmarks to run: {', '.join(SUITES)} (default: all)")
+    parser.add_argument("--rows", type=full_code.positive_int, default=2000, help="profiles: rows inserted one per commit (default: 2000)")
+    parser.add_argument("--batched-rows", type=full_code.positive_int, default=100000, help="profiles: rows inserted in one transaction and read back (default: 100000)")
+    parser.add_argument("--enrollments", type=full_code.positive_int, default=None, help="reports: enrollment rows in the database (default: 1000000); generate: enrollment rows (default: 3 per student)")
+    parser.add_argument("--repeat", type=full_code.positive_int, default=5, help="reports: runs of every report (default: 5)")
+    parser.add_argument("--sizes", type=full_code.positive_int, nargs="+", default=[10000, 100000, 1000000], help="crud: numbers of students (default: 10000 100000 1000000)")
+    parser.add_argument("--samples", type=full_code.positive_int, default=1000, help="crud: calls of every operation (default: 1000)")
+    parser.add_argument("--output", default=None, help="crud: write the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="crud: JSON results of an earlier run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="crud: p50 slowdown reported as a regression (default: 0.2 = 20%%)")
+    parser.add_argument("--backup-students", type=full_code.positive_int, default=200000, help="backup: students in the database that is backed up (default: 200000)")
+    parser.add_argument("--schools", type=full_code.positive_int, default=32, help="federated: number of school databases (default: 32)")
+    parser.add_argument("--school-students", type=full_code.positive_int, default=20000, help="federated: students per school (default: 20000)")
+    parser.add_argument("--workers", type=full_code.positive_int, nargs="+", default=None, help="federated: worker process counts to compare (default: 1, 2, 4, ... up to the core count)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated data (default: 0)")
+    parser.add_argument("--generate", metavar="DB", default=None, help="only fill the empty database DB with --students, --lessons and --enrollments generated rows")
+    parser.add_argument("--students", type=full_code.positive_int, default=10000, help="generate: number of students (default: 10000)")
+    parser.add_argument("--lessons", type=full_code.positive_int, default=50, help="generate: number of lessons (default: 50)")
+    args = parser.parse_args(argv)
+    unknown_suites = [suite for suite in args.suites if suite not in SUITES]
+    if unknown_suites:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown_suites)}")
+
+    if args.generate:
+        if args.enrollments is None:
+            args.enrollments = min(3 * args.students, args.students * args.lessons)
+        full_code.configure_database(args.generate, "bulk")
+        try:
+            full_code.create_tables()
+            seconds, _ = timed(generate_school, full_code.get_connection(), args.students, args.lessons, args.enrollments, args.seed)
+        except ValueError as e:
+            print(e)
+            return 1
+        finally:
+            full_code.close_connection()
+        print(f"Generated {args.students} students, {args.lessons} lessons and {args.enrollments} enrollments in {seconds:.1f}s.")
+        return 0
+
+    suites = args.suites or SUITES
+    if args.enrollments is None:
+        args.enrollments = 1000000
+    if "profiles" in suites:
+        print(f"=== Connection profiles ({args.rows} single-row commits, {args.batched_rows} batched rows) ===")
+        print_profile_results(benchmark_profiles(args.rows, args.batched_rows))
+    if "reports" in suites:
+        print(f"=== Reports, live vs materialized ({args.enrollments} enrollment rows) ===")
+        print_report_results(*benchmark_reports(args.enrollments, args.repeat))
+    if "crud" in suites:
+        results = []
+        for size in args.sizes:
+            print(f"=== CRUD operations ({size} students, {args.samples} samples) ===")
+            size_results = benchmark_crud(size, args.samples, args.seed)
+            print_crud_results(size_results)
+            results.extend(size_results)
+        if args.output:
+            save_crud_results(args.output, results, args.seed, args.samples)
+            print(f"Results written to {args.output}.")
+        if args.compare:
+            with open(args.compare, encoding='utf-8') as file:
+                regressions = find_regressions(results, json.load(file), args.threshold)
+            for result, old in regressions:
+                print(f"REGRESSION {result['operation']} at {result['size']} students: p50 {old['p50_ms']:.3f} ms -> {result['p50_ms']:.3f} ms")
+            if regressions:
+                return 1
+            print(f"No regressions against {args.compare}.")
+    if "backup" in suites:
+        print(f"=== Backup while a writer commits ({args.backup_students} students) ===")
+        print_backup_results(benchmark_backup(args.backup_students))
+    if "federated" in suites:
+        cores = os.cpu_count() or 1
+        worker_counts = args.workers or sorted({2 ** power for power in range(cores.bit_length()) if 2 ** power <= cores} | {cores})
+        print(f"=== Federated queries over {args.schools} schools of {args.school_students} students ({cores} cores) ===")
+        print_federated_results(benchmark_federated(args.schools, args.school_students, worker_counts))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
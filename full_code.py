@@ -1,11 +1,152 @@
+import argparse
+import asyncio
+import csv
+import functools
+import gzip
+import json
+import os
+import queue
+import re
+import shlex
+import shutil
 import sqlite3
-from datetime import datetime
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import date, datetime
+from urllib.request import pathname2url
 
 ###################################### SQL connection & Database Creation ######################################
-# Connect to SQLite database
-conn = sqlite3.connect('SchoolDatabase.db') 
+# Database file and performance profile used by get_connection(); change them with configure_database()
+DATABASE_PATH = 'SchoolDatabase.db'
+DEFAULT_PROFILE = 'fast'
+
+# Named connection tuning profiles:
+# - safe: rollback journal with a full fsync on every commit (SQLite's defaults)
+# - fast: WAL journal, fsync only at checkpoints, larger page cache and memory-mapped reads
+# - bulk: like fast but without fsync at all. An OS crash or power loss can corrupt the whole
+#   database file, not just the last transactions, so only use it on a database you can rebuild
+CONNECTION_PROFILES = {
+    'safe': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,        # negative values are KiB, i.e. 2 MB
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,       # milliseconds
+    },
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+    'bulk': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -64000,
+        'mmap_size': 1024 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 30000,
+    },
+}
+
+# The shared connection, opened by get_connection() the first time it is needed
+conn = None
+database_path = DATABASE_PATH
+database_profile = DEFAULT_PROFILE
+
+# Connection class used by connect(); remembers the database file it was opened on so that
+# per-database caches can tell connections to different files apart
+class SchoolConnection(sqlite3.Connection):
+    def __init__(self, path, *args, **kwargs):
+        super().__init__(path, *args, **kwargs)
+        self.database_path = os.path.abspath(path) if path != ':memory:' else f":memory:{id(self)}"
+        # Loaded by get_lesson_catalog() on first use
+        self.lesson_catalog = None
+        # PRAGMA data_version last seen by get_student_profile()
+        self.profile_data_version = None
+
+# Identify the database a connection is using (connections not made by connect() ask SQLite)
+def database_key(conn):
+    path = getattr(conn, "database_path", None)
+    if path is None:
+        path = conn.execute("PRAGMA database_list").fetchone()[2] or f":memory:{id(conn)}"
+    return path
+
+# Open a new connection to the database at path and apply a tuning profile to it.
+# Pass check_same_thread=False for connections that are handed between threads (see ConnectionPool).
+def connect(path=DATABASE_PATH, profile=DEFAULT_PROFILE, check_same_thread=True):
+    if profile not in CONNECTION_PROFILES:
+        raise ValueError(f"Unknown connection profile '{profile}'. Choose one of: {', '.join(CONNECTION_PROFILES)}.")
+    settings = CONNECTION_PROFILES[profile]
+    connection = sqlite3.connect(path, timeout=settings['busy_timeout'] / 1000, check_same_thread=check_same_thread,
+                                 factory=SchoolConnection if query_stats is None else InstrumentedConnection)
+    connection.execute(f"PRAGMA journal_mode = {settings['journal_mode']}")
+    connection.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+    connection.execute(f"PRAGMA cache_size = {settings['cache_size']}")
+    connection.execute(f"PRAGMA mmap_size = {settings['mmap_size']}")
+    connection.execute(f"PRAGMA temp_store = {settings['temp_store']}")
+    connection.execute(f"PRAGMA busy_timeout = {settings['busy_timeout']}")
+    # Enforce the foreign keys declared on student_lessons (SQLite leaves them off by default)
+    connection.execute("PRAGMA foreign_keys = ON")
+    return connection
+
+# Choose the database file and profile used by the shared connection.
+# An already open shared connection is closed so the next call to get_connection() uses the new settings.
+def configure_database(path=None, profile=None):
+    global database_path, database_profile
+    if profile is not None and profile not in CONNECTION_PROFILES:
+        raise ValueError(f"Unknown connection profile '{profile}'. Choose one of: {', '.join(CONNECTION_PROFILES)}.")
+    close_connection()
+    if path is not None:
+        database_path = path
+    if profile is not None:
+        database_profile = profile
+
+# Return the shared connection, opening it on first use
+def get_connection():
+    global conn
+    if conn is None:
+        conn = connect(database_path, database_profile)
+    return conn
+
+def close_connection():
+    global conn
+    if conn is not None:
+        conn.close()
+        conn = None
+
+# Run a block of writes as one transaction. When the connection is already inside a transaction
+# (e.g. a batch script) the block becomes a savepoint of that transaction instead of committing it.
+@contextmanager
+def transaction(conn):
+    if not conn.in_transaction:
+        # sqlite3 only opens a transaction by itself before INSERT/UPDATE/DELETE/REPLACE statements,
+        # not before e.g. WITH ... UPDATE, so the block starts it explicitly
+        conn.execute("BEGIN")
+        with conn:
+            yield conn
+        return
+    conn.execute("SAVEPOINT nested_transaction")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK TO nested_transaction")
+        conn.execute("RELEASE nested_transaction")
+        raise
+    conn.execute("RELEASE nested_transaction")
+
 # Function to create the database tables if they don't exist
-def create_tables():
+def create_tables(conn=None):
+    if conn is None:
+        conn = get_connection()
     conn.execute('''CREATE TABLE IF NOT EXISTS students (
                     id INTEGER PRIMARY KEY NOT NULL,
                     first_name TEXT NOT NULL,
@@ -26,9 +167,1166 @@ def create_tables():
                     FOREIGN KEY (lesson_id) REFERENCES lessons(id),
                     PRIMARY KEY (student_id, lesson_id))''')
 
+    # Bring databases created by older versions of the program up to date
+    migrate_database(conn)
+
+############################################## Query Instrumentation ##############################################
+# Per-statement timing for finding the slow conn.execute(...) calls. It is off by default: connect()
+# then opens plain SchoolConnections and nothing is measured at all. enable_query_stats() makes
+# connect() open InstrumentedConnections instead, whose cursors time every execute and every fetch.
+DEFAULT_SLOW_QUERY_MS = 100
+SLOW_QUERY_LOG_SIZE = 100       # slow queries kept in memory; the log file keeps all of them
+EXPLAINABLE_STATEMENTS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+# The statistics collected by instrumented connections (None while instrumentation is off)
+query_stats = None
+
+# Counts, total and max latency and rows returned per SQL statement, plus a log of the executions
+# that took longer than slow_seconds together with their query plan. Shared by all threads.
+class QueryStats:
+    def __init__(self, slow_seconds, slow_log_path=None):
+        self.slow_seconds = slow_seconds
+        self.slow_log_path = slow_log_path
+        self.statements = {}        # sql -> [calls, total seconds, max seconds, rows]
+        self.slow_queries = []
+        self.lock = threading.Lock()
+
+    # Add seconds and rows to a statement. elapsed is the time its current execution has taken so far.
+    def record(self, sql, seconds, rows, elapsed, new_call=False):
+        with self.lock:
+            entry = self.statements.get(sql)
+            if entry is None:
+                entry = self.statements[sql] = [0, 0.0, 0.0, 0]
+            if new_call:
+                entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], elapsed)
+            entry[3] += rows
+
+    # Log an execution that passed the threshold, with its EXPLAIN QUERY PLAN when it has one
+    def log_slow(self, conn, sql, parameters, elapsed):
+        plan = None
+        if parameters is not None and sql.lstrip().upper().startswith(EXPLAINABLE_STATEMENTS):
+            try:
+                # Called on the base class so the plan itself is not measured
+                plan = [row[3] for row in sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", parameters)]
+            except sqlite3.Error:
+                pass
+        entry = {"time": datetime.now().isoformat(timespec="seconds"), "sql": sql,
+                 "ms": round(elapsed * 1000, 3), "plan": plan}
+        with self.lock:
+            self.slow_queries.append(entry)
+            del self.slow_queries[:-SLOW_QUERY_LOG_SIZE]
+            if self.slow_log_path:
+                with open(self.slow_log_path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(entry) + "\n")
+
+    # Statements ordered by total time, slowest first
+    def summary(self):
+        with self.lock:
+            statements = [{"sql": sql, "calls": calls, "total_ms": total * 1000, "avg_ms": total * 1000 / calls if calls else 0.0,
+                           "max_ms": longest * 1000, "rows": rows}
+                          for sql, (calls, total, longest, rows) in self.statements.items()]
+            slow_queries = list(self.slow_queries)
+        statements.sort(key=lambda statement: statement["total_ms"], reverse=True)
+        return {"slow_ms": self.slow_seconds * 1000, "statements": statements, "slow_queries": slow_queries}
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def reset(self):
+        with self.lock:
+            self.statements.clear()
+            self.slow_queries.clear()
+
+# Cursor that times its executions. The time spent fetching rows counts towards the statement
+# that produced them, so the latency of a streamed SELECT includes reading all of its rows.
+class InstrumentedCursor(sqlite3.Cursor):
+    statement_sql = None
+
+    def start_statement(self, sql, parameters, seconds):
+        self.statement_sql = " ".join(sql.split())
+        self.statement_parameters = parameters
+        self.statement_elapsed = 0.0
+        self.statement_logged = False
+        self.add_time(seconds, 0, new_call=True)
+
+    def add_time(self, seconds, rows, new_call=False):
+        stats = query_stats
+        if stats is None or self.statement_sql is None:
+            return
+        self.statement_elapsed += seconds
+        stats.record(self.statement_sql, seconds, rows, self.statement_elapsed, new_call)
+        if not self.statement_logged and self.statement_elapsed >= stats.slow_seconds:
+            self.statement_logged = True
+            stats.log_slow(self.connection, self.statement_sql, self.statement_parameters, self.statement_elapsed)
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.start_statement(sql, parameters, time.perf_counter() - started)
+
+    # executemany and executescript have no single set of parameters to explain
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.start_statement(sql, None, time.perf_counter() - started)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self.start_statement(sql_script, None, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self.add_time(time.perf_counter() - started, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self.add_time(time.perf_counter() - started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self.add_time(time.perf_counter() - started, len(rows))
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self.add_time(time.perf_counter() - started, 0)
+            raise
+        self.add_time(time.perf_counter() - started, 1)
+        return row
+
+# Connection whose cursors, including the ones behind conn.execute(...), are InstrumentedCursors
+class InstrumentedConnection(SchoolConnection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+# Measure every connection opened from now on; slow queries (slow_ms or longer) are also
+# appended to slow_log_path as JSON lines. The shared connection is reopened instrumented.
+def enable_query_stats(slow_ms=DEFAULT_SLOW_QUERY_MS, slow_log_path=None):
+    global query_stats
+    close_connection()
+    query_stats = QueryStats(slow_ms / 1000, slow_log_path)
+    return query_stats
+
+def disable_query_stats():
+    global query_stats
+    close_connection()
+    query_stats = None
+
+############################################## Schema Migrations ##############################################
+# Each migration upgrades the schema by one version. PRAGMA user_version stores the number
+# of the last migration applied, so existing SchoolDatabase.db files are upgraded in place.
+
+## Migration 1: indexes for the lookups the CLI performs
+def migration_add_lookup_indexes(conn):
+    duplicate = conn.execute("SELECT name FROM lessons GROUP BY name HAVING COUNT(*) > 1").fetchone()
+    if duplicate:
+        raise sqlite3.IntegrityError(f"Lesson name '{duplicate[0]}' is used more than once. Rename the duplicates before upgrading.")
+    # add_lesson / modify_lesson name uniqueness check
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_lessons_name ON lessons (name)")
+    # Enrollment lookups keyed by lesson (the primary key only helps lookups keyed by student)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_student_lessons_lesson ON student_lessons (lesson_id, student_id)")
+    # Searching students by name
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_students_name ON students (last_name, first_name)")
+
+## Migration 2: delete enrollments together with their student or lesson
+# SQLite cannot change a foreign key in place, so student_lessons is rebuilt with ON DELETE CASCADE.
+# Enrollments whose student or lesson no longer exists cannot satisfy the new foreign keys and are dropped.
+def migration_cascade_enrollment_deletes(conn):
+    conn.execute('''CREATE TABLE student_lessons_new (
+                    student_id INTEGER,
+                    lesson_id INTEGER,
+                    FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE,
+                    FOREIGN KEY (lesson_id) REFERENCES lessons(id) ON DELETE CASCADE,
+                    PRIMARY KEY (student_id, lesson_id))''')
+    conn.execute("""
+        INSERT INTO student_lessons_new (student_id, lesson_id)
+        SELECT student_id, lesson_id FROM student_lessons
+        WHERE student_id IN (SELECT id FROM students) AND lesson_id IN (SELECT id FROM lessons)
+        """)
+    conn.execute("DROP TABLE student_lessons")
+    conn.execute("ALTER TABLE student_lessons_new RENAME TO student_lessons")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_student_lessons_lesson ON student_lessons (lesson_id, student_id)")
+
+## Migration 3: full-text search over student and lesson names
+# External content FTS5 tables store only the index; the triggers keep them in sync with
+# students and lessons. The prefix indexes make prefix queries ("moh*") index lookups.
+def migration_add_name_search(conn):
+    conn.execute("""CREATE VIRTUAL TABLE students_fts USING fts5(
+                    first_name, last_name,
+                    content='students', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')""")
+    conn.execute("""CREATE VIRTUAL TABLE lessons_fts USING fts5(
+                    name,
+                    content='lessons', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')""")
+
+    create_name_search_triggers(conn)
+
+    # Index the rows that already exist
+    conn.execute("INSERT INTO students_fts (students_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO lessons_fts (lessons_fts) VALUES ('rebuild')")
+
+# Triggers that keep students_fts and lessons_fts in sync (recreated whenever their table is rebuilt)
+def create_name_search_triggers(conn):
+    conn.execute("""CREATE TRIGGER students_fts_insert AFTER INSERT ON students BEGIN
+                    INSERT INTO students_fts (rowid, first_name, last_name) VALUES (new.id, new.first_name, new.last_name);
+                    END""")
+    conn.execute("""CREATE TRIGGER students_fts_delete AFTER DELETE ON students BEGIN
+                    INSERT INTO students_fts (students_fts, rowid, first_name, last_name) VALUES ('delete', old.id, old.first_name, old.last_name);
+                    END""")
+    conn.execute("""CREATE TRIGGER students_fts_update AFTER UPDATE OF id, first_name, last_name ON students BEGIN
+                    INSERT INTO students_fts (students_fts, rowid, first_name, last_name) VALUES ('delete', old.id, old.first_name, old.last_name);
+                    INSERT INTO students_fts (rowid, first_name, last_name) VALUES (new.id, new.first_name, new.last_name);
+                    END""")
+
+    conn.execute("""CREATE TRIGGER lessons_fts_insert AFTER INSERT ON lessons BEGIN
+                    INSERT INTO lessons_fts (rowid, name) VALUES (new.id, new.name);
+                    END""")
+    conn.execute("""CREATE TRIGGER lessons_fts_delete AFTER DELETE ON lessons BEGIN
+                    INSERT INTO lessons_fts (lessons_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                    END""")
+    conn.execute("""CREATE TRIGGER lessons_fts_update AFTER UPDATE OF id, name ON lessons BEGIN
+                    INSERT INTO lessons_fts (lessons_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                    INSERT INTO lessons_fts (rowid, name) VALUES (new.id, new.name);
+                    END""")
+
+## Migration 4: summary tables for the reports, kept up to date by triggers
+# SQL that adds 1 to / removes 1 from the counter of key in a summary table. Counters that
+# drop to zero are deleted so the summary has the same rows as the live GROUP BY.
+def summary_count_up(table, key_column, count_column, key):
+    return (f"INSERT INTO {table} ({key_column}, {count_column}) VALUES ({key}, 1) "
+            f"ON CONFLICT ({key_column}) DO UPDATE SET {count_column} = {count_column} + 1;")
+
+def summary_count_down(table, key_column, count_column, key):
+    return (f"UPDATE {table} SET {count_column} = {count_column} - 1 WHERE {key_column} = {key}; "
+            f"DELETE FROM {table} WHERE {key_column} = {key} AND {count_column} <= 0;")
+
+# SQL for the 'YYYY-MM' month of an enrollment date column: report_month for day numbers
+# (migration 5 onwards), text_date_month for the YYYY-MM-DD text stored before that
+def report_month(column):
+    return f"COALESCE(strftime('%Y-%m', {column} * 86400, 'unixepoch'), 'unknown')"
+
+def text_date_month(column):
+    return f"COALESCE(substr({column}, 1, 7), 'unknown')"
+
+def migration_add_report_summaries(conn):
+    conn.execute("CREATE TABLE report_grade_counts (grade INTEGER PRIMARY KEY, students INTEGER NOT NULL)")
+    conn.execute("CREATE TABLE report_month_counts (month TEXT PRIMARY KEY NOT NULL, students INTEGER NOT NULL)")
+    conn.execute("CREATE TABLE report_lesson_counts (lesson_id INTEGER PRIMARY KEY, enrollments INTEGER NOT NULL)")
+    create_report_student_triggers(conn, text_date_month)
+    create_report_enrollment_triggers(conn)
+    rebuild_report_tables(conn, text_date_month)
+
+# Triggers that keep the summary tables up to date (recreated whenever their table is rebuilt)
+def create_report_student_triggers(conn, month):
+    new_month = month("new.enrollement_date")
+    old_month = month("old.enrollement_date")
+    conn.execute(f"""CREATE TRIGGER report_students_insert AFTER INSERT ON students BEGIN
+                    {summary_count_up("report_grade_counts", "grade", "students", "new.grade")}
+                    {summary_count_up("report_month_counts", "month", "students", new_month)}
+                    END""")
+    conn.execute(f"""CREATE TRIGGER report_students_delete AFTER DELETE ON students BEGIN
+                    {summary_count_down("report_grade_counts", "grade", "students", "old.grade")}
+                    {summary_count_down("report_month_counts", "month", "students", old_month)}
+                    END""")
+    conn.execute(f"""CREATE TRIGGER report_students_update AFTER UPDATE OF grade, enrollement_date ON students BEGIN
+                    {summary_count_down("report_grade_counts", "grade", "students", "old.grade")}
+                    {summary_count_up("report_grade_counts", "grade", "students", "new.grade")}
+                    {summary_count_down("report_month_counts", "month", "students", old_month)}
+                    {summary_count_up("report_month_counts", "month", "students", new_month)}
+                    END""")
+
+def create_report_enrollment_triggers(conn):
+    conn.execute(f"""CREATE TRIGGER report_enrollments_insert AFTER INSERT ON student_lessons BEGIN
+                    {summary_count_up("report_lesson_counts", "lesson_id", "enrollments", "new.lesson_id")}
+                    END""")
+    conn.execute(f"""CREATE TRIGGER report_enrollments_delete AFTER DELETE ON student_lessons BEGIN
+                    {summary_count_down("report_lesson_counts", "lesson_id", "enrollments", "old.lesson_id")}
+                    END""")
+    conn.execute(f"""CREATE TRIGGER report_enrollments_update AFTER UPDATE OF lesson_id ON student_lessons BEGIN
+                    {summary_count_down("report_lesson_counts", "lesson_id", "enrollments", "old.lesson_id")}
+                    {summary_count_up("report_lesson_counts", "lesson_id", "enrollments", "new.lesson_id")}
+                    END""")
+
+## Migration 5: STRICT tables with dates stored as day numbers
+# Dates become INTEGER days since 1970-01-01 (see date_to_day), which are smaller than
+# YYYY-MM-DD text and compare as numbers, and the age and grade rules become CHECK
+# constraints. All three tables are rebuilt, so their indexes and triggers are recreated.
+# The text dates are converted with the same parser that validated them when they were entered,
+# which also accepts dates without leading zeros such as 2023-9-1 (SQLite's date functions do not).
+def legacy_date_to_day(value):
+    try:
+        return date_to_day(value)
+    except (TypeError, ValueError):
+        return None
+
+def migration_strict_tables(conn):
+    conn.create_function("legacy_date_to_day", 1, legacy_date_to_day, deterministic=True)
+    invalid = conn.execute("""
+        SELECT id FROM students
+        WHERE typeof(age) != 'integer' OR age NOT BETWEEN 5 AND 19
+           OR typeof(grade) != 'integer' OR grade NOT BETWEEN 1 AND 12
+           OR (enrollement_date IS NOT NULL AND legacy_date_to_day(enrollement_date) IS NULL)
+           OR (data_entry_date IS NOT NULL AND legacy_date_to_day(data_entry_date) IS NULL)
+        LIMIT 1""").fetchone()
+    if invalid:
+        raise sqlite3.IntegrityError(f"Student {invalid[0]} has an invalid age, grade or date. Correct it before upgrading.")
+
+    conn.execute('''CREATE TABLE students_new (
+                    id INTEGER PRIMARY KEY NOT NULL,
+                    first_name TEXT NOT NULL,
+                    last_name TEXT NOT NULL,
+                    age INTEGER NOT NULL CHECK (age BETWEEN 5 AND 19),
+                    grade INTEGER NOT NULL CHECK (grade BETWEEN 1 AND 12),
+                    enrollement_date INTEGER,
+                    data_entry_date INTEGER) STRICT''')
+    conn.execute('''CREATE TABLE lessons_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+                    name TEXT NOT NULL) STRICT''')
+    conn.execute('''CREATE TABLE student_lessons_new (
+                    student_id INTEGER,
+                    lesson_id INTEGER,
+                    FOREIGN KEY (student_id) REFERENCES students_new(id) ON DELETE CASCADE,
+                    FOREIGN KEY (lesson_id) REFERENCES lessons_new(id) ON DELETE CASCADE,
+                    PRIMARY KEY (student_id, lesson_id)) STRICT''')
+    conn.execute("""
+        INSERT INTO students_new (id, first_name, last_name, age, grade, enrollement_date, data_entry_date)
+        SELECT id, first_name, last_name, age, grade, legacy_date_to_day(enrollement_date), legacy_date_to_day(data_entry_date)
+        FROM students""")
+    conn.execute("INSERT INTO lessons_new (id, name) SELECT id, name FROM lessons")
+    conn.execute("INSERT INTO student_lessons_new (student_id, lesson_id) SELECT student_id, lesson_id FROM student_lessons")
+    last_lesson_id = conn.execute("SELECT MAX(seq) FROM sqlite_sequence WHERE name IN ('lessons', 'lessons_new')").fetchone()[0]
+
+    # student_lessons goes first, so dropping the parent tables cannot cascade into any enrollments.
+    # Renaming the new parent tables updates the foreign keys of student_lessons_new to match.
+    conn.execute("DROP TABLE student_lessons")
+    conn.execute("DROP TABLE students")
+    conn.execute("DROP TABLE lessons")
+    conn.execute("ALTER TABLE students_new RENAME TO students")
+    conn.execute("ALTER TABLE lessons_new RENAME TO lessons")
+    conn.execute("ALTER TABLE student_lessons_new RENAME TO student_lessons")
+    # Keep AUTOINCREMENT from reusing the IDs of lessons deleted before the upgrade
+    if last_lesson_id is not None:
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'lessons'")
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('lessons', ?)", (last_lesson_id,))
+
+    conn.execute("CREATE UNIQUE INDEX idx_lessons_name ON lessons (name)")
+    conn.execute("CREATE INDEX idx_student_lessons_lesson ON student_lessons (lesson_id, student_id)")
+    conn.execute("CREATE INDEX idx_students_name ON students (last_name, first_name)")
+    # Enrollment date ranges (delete-students)
+    conn.execute("CREATE INDEX idx_students_enrollement_date ON students (enrollement_date)")
+    create_name_search_triggers(conn)
+    create_report_student_triggers(conn, report_month)
+    create_report_enrollment_triggers(conn)
+    # The months of the report summary were cut from the text dates, which breaks on 2023-9-1
+    rebuild_report_tables(conn)
+
+## Migration 6: change log for syncing other systems
+# Triggers append every insert, update and delete of students, lessons and enrollments to
+# change_log, with the row before and/or after the change as JSON objects (dates as YYYY-MM-DD).
+# seq only ever grows (AUTOINCREMENT never reuses a number, even after pruning, and a restore
+# continues after the highest seq used before it), so a consumer only has to remember the last seq it has read. change_log_consumers stores those positions.
+CHANGE_LOG_COLUMNS = {
+    "students": ["id", "first_name", "last_name", "age", "grade", "enrollement_date", "data_entry_date"],
+    "lessons": ["id", "name"],
+    "student_lessons": ["student_id", "lesson_id"],
+}
+DAY_NUMBER_COLUMNS = ("enrollement_date", "data_entry_date")
+
+# SQL for the JSON object of the new or old row of table inside a trigger
+def change_log_row(table, row):
+    fields = []
+    for column in CHANGE_LOG_COLUMNS[table]:
+        value = f"{row}.{column}"
+        if column in DAY_NUMBER_COLUMNS:
+            value = f"date({value} * 86400, 'unixepoch')"
+        fields.append(f"'{column}', {value}")
+    return f"json_object({', '.join(fields)})"
+
+def migration_add_change_log(conn):
+    conn.execute('''CREATE TABLE change_log (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    changed_at INTEGER NOT NULL DEFAULT (unixepoch()),
+                    table_name TEXT NOT NULL,
+                    operation TEXT NOT NULL CHECK (operation IN ('insert', 'update', 'delete')),
+                    before TEXT,
+                    after TEXT) STRICT''')
+    conn.execute('''CREATE TABLE change_log_consumers (
+                    name TEXT PRIMARY KEY NOT NULL,
+                    last_seq INTEGER NOT NULL) STRICT''')
+    create_change_log_triggers(conn)
+
+# Triggers that fill change_log (recreated whenever one of the tables is rebuilt).
+# Updates that leave every column as it was are not logged.
+def create_change_log_triggers(conn):
+    for table, columns in CHANGE_LOG_COLUMNS.items():
+        old_values = ", ".join(f"old.{column}" for column in columns)
+        new_values = ", ".join(f"new.{column}" for column in columns)
+        conn.execute(f"""CREATE TRIGGER change_log_{table}_insert AFTER INSERT ON {table} BEGIN
+                        INSERT INTO change_log (table_name, operation, after) VALUES ('{table}', 'insert', {change_log_row(table, "new")});
+                        END""")
+        conn.execute(f"""CREATE TRIGGER change_log_{table}_update AFTER UPDATE ON {table} WHEN ({old_values}) IS NOT ({new_values}) BEGIN
+                        INSERT INTO change_log (table_name, operation, before, after)
+                        VALUES ('{table}', 'update', {change_log_row(table, "old")}, {change_log_row(table, "new")});
+                        END""")
+        conn.execute(f"""CREATE TRIGGER change_log_{table}_delete AFTER DELETE ON {table} BEGIN
+                        INSERT INTO change_log (table_name, operation, before) VALUES ('{table}', 'delete', {change_log_row(table, "old")});
+                        END""")
+
+## Migration 7: misspelled name search
+# Trigram FTS5 indexes find the names that share three-letter pieces with a search word, which
+# the prefix indexes of migration 3 cannot: "Mohamad" is not a prefix of "Mohammed". The search
+# functions only use them when a prefix search finds nothing (see fuzzy_search).
+def migration_add_fuzzy_name_search(conn):
+    conn.execute("""CREATE VIRTUAL TABLE students_trigram USING fts5(
+                    first_name, last_name,
+                    content='students', content_rowid='id', tokenize='trigram')""")
+    conn.execute("""CREATE VIRTUAL TABLE lessons_trigram USING fts5(
+                    name,
+                    content='lessons', content_rowid='id', tokenize='trigram')""")
+
+    create_fuzzy_search_triggers(conn)
+
+    conn.execute("INSERT INTO students_trigram (students_trigram) VALUES ('rebuild')")
+    conn.execute("INSERT INTO lessons_trigram (lessons_trigram) VALUES ('rebuild')")
+
+# Triggers that keep students_trigram and lessons_trigram in sync (recreated whenever their table is rebuilt)
+def create_fuzzy_search_triggers(conn):
+    conn.execute("""CREATE TRIGGER students_trigram_insert AFTER INSERT ON students BEGIN
+                    INSERT INTO students_trigram (rowid, first_name, last_name) VALUES (new.id, new.first_name, new.last_name);
+                    END""")
+    conn.execute("""CREATE TRIGGER students_trigram_delete AFTER DELETE ON students BEGIN
+                    INSERT INTO students_trigram (students_trigram, rowid, first_name, last_name) VALUES ('delete', old.id, old.first_name, old.last_name);
+                    END""")
+    conn.execute("""CREATE TRIGGER students_trigram_update AFTER UPDATE OF id, first_name, last_name ON students BEGIN
+                    INSERT INTO students_trigram (students_trigram, rowid, first_name, last_name) VALUES ('delete', old.id, old.first_name, old.last_name);
+                    INSERT INTO students_trigram (rowid, first_name, last_name) VALUES (new.id, new.first_name, new.last_name);
+                    END""")
+
+    conn.execute("""CREATE TRIGGER lessons_trigram_insert AFTER INSERT ON lessons BEGIN
+                    INSERT INTO lessons_trigram (rowid, name) VALUES (new.id, new.name);
+                    END""")
+    conn.execute("""CREATE TRIGGER lessons_trigram_delete AFTER DELETE ON lessons BEGIN
+                    INSERT INTO lessons_trigram (lessons_trigram, rowid, name) VALUES ('delete', old.id, old.name);
+                    END""")
+    conn.execute("""CREATE TRIGGER lessons_trigram_update AFTER UPDATE OF id, name ON lessons BEGIN
+                    INSERT INTO lessons_trigram (lessons_trigram, rowid, name) VALUES ('delete', old.id, old.name);
+                    INSERT INTO lessons_trigram (rowid, name) VALUES (new.id, new.name);
+                    END""")
+
+## Migration 8: restore markers in the change log
+# restore_database appends a 'restore' entry after replacing the data, telling consumers that
+# the rows they exported before it may have been reverted. The CHECK constraint of change_log
+# cannot be changed in place, so the table is rebuilt; its triggers are dropped first, as they
+# would otherwise point at the old table.
+def migration_allow_restore_markers(conn):
+    for table in CHANGE_LOG_COLUMNS:
+        for operation in ("insert", "update", "delete"):
+            conn.execute(f"DROP TRIGGER change_log_{table}_{operation}")
+    conn.execute('''CREATE TABLE change_log_new (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    changed_at INTEGER NOT NULL DEFAULT (unixepoch()),
+                    table_name TEXT NOT NULL,
+                    operation TEXT NOT NULL CHECK (operation IN ('insert', 'update', 'delete', 'restore')),
+                    before TEXT,
+                    after TEXT) STRICT''')
+    conn.execute("""
+        INSERT INTO change_log_new (seq, changed_at, table_name, operation, before, after)
+        SELECT seq, changed_at, table_name, operation, before, after FROM change_log""")
+    last_seq = conn.execute("SELECT MAX(seq) FROM sqlite_sequence WHERE name IN ('change_log', 'change_log_new')").fetchone()[0]
+    conn.execute("DROP TABLE change_log")
+    conn.execute("ALTER TABLE change_log_new RENAME TO change_log")
+    # Keep seq growing past changes that were already pruned
+    if last_seq is not None:
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'change_log'")
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', ?)", (last_seq,))
+    create_change_log_triggers(conn)
+
+MIGRATIONS = [
+    migration_add_lookup_indexes,
+    migration_cascade_enrollment_deletes,
+    migration_add_name_search,
+    migration_add_report_summaries,
+    migration_strict_tables,
+    migration_add_change_log,
+    migration_add_fuzzy_name_search,
+    migration_allow_restore_markers,
+]
+
+# Apply every migration newer than the database's user_version, each in its own transaction
+def migrate_database(conn=None):
+    if conn is None:
+        conn = get_connection()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+############################################## Validation Helpers ##############################################
+# Check that a date string is in YYYY-MM-DD format
+def valid_date_format(date_input):
+    try:
+        datetime.strptime(date_input, '%Y-%m-%d')
+        return True
+    except ValueError:
+        return False
+
+# Dates are stored as day numbers (days since 1970-01-01) and turned back into YYYY-MM-DD
+# strings only when they are shown
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def day_number(day):
+    return day.toordinal() - EPOCH_ORDINAL
+
+def date_to_day(date_input):
+    return day_number(datetime.strptime(date_input, '%Y-%m-%d'))
+
+def day_to_date(day):
+    return None if day is None else date.fromordinal(day + EPOCH_ORDINAL).isoformat()
+
+# Field validators shared by the interactive prompts, the bulk importer and update_student.
+# Each one returns the cleaned value or raises ValueError with the reason it is invalid.
+def validate_name(value, label):
+    value = str(value).strip()
+    if value == "":
+        raise ValueError(f"{label} cannot be empty.")
+    if any(char.isdigit() for char in value):
+        raise ValueError(f"{label} cannot contain numbers.")
+    return value
+
+def validate_age(value):
+    try:
+        age = int(str(value).strip())
+    except ValueError:
+        raise ValueError("Age must be a number between 5 and 19.")
+    if age < 5 or age > 19:
+        raise ValueError("Age must be between 5 and 19.")
+    return age
+
+def validate_grade(value):
+    try:
+        grade = int(str(value).strip())
+    except ValueError:
+        raise ValueError("Grade must be an integer between 1 and 12.")
+    if grade < 1 or grade > 12:
+        raise ValueError("Grade must be between 1 and 12.")
+    return grade
+
+# Returns the date as the day number it is stored as
+def validate_enrollement_date(value):
+    value = str(value).strip()
+    if value == "":
+        raise ValueError("Enrollment date cannot be empty.")
+    if not valid_date_format(value):
+        raise ValueError("Invalid date format. Enrollment date must be in YYYY-MM-DD format.")
+    return date_to_day(value)
+
+# Columns of the students table that can be changed after a student is added
+STUDENT_FIELD_VALIDATORS = {
+    "first_name": lambda value: validate_name(value, "First name"),
+    "last_name": lambda value: validate_name(value, "Last name"),
+    "age": validate_age,
+    "grade": validate_grade,
+    "enrollement_date": validate_enrollement_date,
+}
+
+# Validate a dict of changed student fields, raising ValueError for unknown columns or invalid values
+def validate_student_changes(changes):
+    cleaned = {}
+    for field, value in changes.items():
+        if field not in STUDENT_FIELD_VALIDATORS:
+            raise ValueError(f"Unknown student field: {field}.")
+        cleaned[field] = STUDENT_FIELD_VALIDATORS[field](value)
+    return cleaned
+
+# Read a field from an import record as a stripped string ("" if missing)
+def record_field(record, name):
+    value = record.get(name)
+    return "" if value is None else str(value).strip()
+
+# Apply the same checks as add_student to a record read from an import file.
+# Returns (student_row, lesson_ids) or raises ValueError with the reason the record is invalid.
+def validate_student_record(record):
+    if not isinstance(record, dict):
+        raise ValueError("Row is not a valid JSON object.")
+
+    id_input = record_field(record, "id")
+    if id_input == "":
+        raise ValueError("Student ID cannot be empty.")
+    try:
+        id = int(id_input)
+    except ValueError:
+        raise ValueError("Student ID must be a valid integer.")
+
+    first_name = validate_name(record_field(record, "first_name"), "First name")
+    last_name = validate_name(record_field(record, "last_name"), "Last name")
+    age = validate_age(record_field(record, "age"))
+    grade = validate_grade(record_field(record, "grade"))
+    enrollement_date = validate_enrollement_date(record_field(record, "enrollement_date"))
+
+    # Lessons are a ';'-separated string in CSV files and a list (or string) in JSONL files
+    lessons = record.get("lessons") or []
+    if isinstance(lessons, str):
+        lessons = [part for part in lessons.replace(",", ";").split(";") if part.strip()]
+    elif not isinstance(lessons, list):
+        lessons = [lessons]
+    try:
+        lesson_ids = list(dict.fromkeys(int(str(lesson).strip()) for lesson in lessons))
+    except ValueError:
+        raise ValueError("Lesson IDs must be integers.")
+
+    return (id, first_name, last_name, age, grade, enrollement_date), lesson_ids
+
+############################################## Data Access ##############################################
+# Database operations without any input()/print(). Every function takes the connection to use
+# as its first argument, so they work with the shared CLI connection as well as with the
+# connections handed out by ConnectionPool. Invalid input is reported with ValueError.
+
+## Students
+def student_exists(conn, student_id):
+    return conn.execute("SELECT 1 FROM students WHERE id = ?", (student_id,)).fetchone() is not None
+
+def fetch_student(conn, student_id):
+    return conn.execute("SELECT * FROM students WHERE id = ?", (student_id,)).fetchone()
+
+# IDs of the lessons a student is enrolled in
+def fetch_enrolled_lesson_ids(conn, student_id):
+    return [row[0] for row in conn.execute("SELECT lesson_id FROM student_lessons WHERE student_id = ?", (student_id,))]
+
+# Validate a student record (same fields as the import files) and insert it together with its
+# lessons in one transaction. Returns the ID of the new student.
+def insert_student(conn, record):
+    student, lessons = validate_student_record(record)
+    if student_exists(conn, student[0]):
+        raise ValueError("A student with this ID already exists.")
+    known_lessons = get_lesson_catalog(conn).names_by_id
+    unknown_lessons = [lesson_id for lesson_id in lessons if lesson_id not in known_lessons]
+    if unknown_lessons:
+        raise ValueError(f"Unknown lesson ID(s): {', '.join(map(str, unknown_lessons))}.")
+
+    data_entry_date = day_number(date.today())
+    with transaction(conn):
+        conn.execute("INSERT INTO students (id, first_name, last_name, age, grade, enrollement_date, data_entry_date) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     student + (data_entry_date,))
+        conn.executemany("INSERT INTO student_lessons (student_id, lesson_id) VALUES (?, ?)",
+                         [(student[0], lesson_id) for lesson_id in lessons])
+    return student[0]
+
+DEFAULT_PAGE_SIZE = 20
+
+# Keyset pagination: fetch the page of students that comes right after after_id.
+# Every page is a primary key range scan, so its cost does not grow with the table size.
+def fetch_students_page(conn, after_id=None, page_size=DEFAULT_PAGE_SIZE):
+    if after_id is None:
+        return conn.execute("SELECT id, first_name, last_name FROM students ORDER BY id ASC LIMIT ?",
+                            (page_size,)).fetchall()
+    return conn.execute("SELECT id, first_name, last_name FROM students WHERE id > ? ORDER BY id ASC LIMIT ?",
+                        (after_id, page_size)).fetchall()
+
+# Fetch the page of students that comes right before before_id (returned in ascending order)
+def fetch_students_page_before(conn, before_id, page_size=DEFAULT_PAGE_SIZE):
+    students = conn.execute("SELECT id, first_name, last_name FROM students WHERE id < ? ORDER BY id DESC LIMIT ?",
+                            (before_id, page_size)).fetchall()
+    students.reverse()
+    return students
+
+# Yield every student (after after_id, if given) ordered by ID while holding at most one page in memory
+def iter_students(conn, after_id=None, page_size=500):
+    while True:
+        students = fetch_students_page(conn, after_id, page_size)
+        yield from students
+        if len(students) < page_size:
+            return
+        after_id = students[-1][0]
+
+# Apply a dict of changed fields to one student with a single UPDATE ... RETURNING statement.
+# Returns the updated row, or None when no student has this ID.
+def update_student(conn, student_id, changes):
+    changes = validate_student_changes(changes)
+    if not changes:
+        return fetch_student(conn, student_id)
+    assignments = ", ".join(f"{field} = ?" for field in changes)
+    with transaction(conn):
+        student = conn.execute(f"UPDATE students SET {assignments} WHERE id = ? RETURNING *",
+                               (*changes.values(), student_id)).fetchone()
+    profile_cache.invalidate_students(database_key(conn), [student_id])
+    return student
+
+UPDATE_ROWS_PER_STATEMENT = 500
+
+# Apply many (student_id, changes) pairs in one transaction. Pairs changing the same set of
+# fields are written with one set-based UPDATE ... FROM (VALUES ...) statement, so e.g. a
+# year-end grade promotion of every student is one statement instead of one per student.
+# Returns the IDs of the students that were updated.
+def update_students(conn, updates):
+    # Later changes for the same student are merged into earlier ones
+    merged = {}
+    for student_id, changes in updates:
+        merged.setdefault(student_id, {}).update(validate_student_changes(changes))
+
+    groups = {}
+    for student_id, changes in merged.items():
+        if changes:
+            groups.setdefault(tuple(changes), []).append((student_id, *changes.values()))
+
+    updated_ids = []
+    with transaction(conn):
+        for fields, rows in groups.items():
+            columns = ", ".join(("id",) + fields)
+            assignments = ", ".join(f"{field} = changes.{field}" for field in fields)
+            row_placeholders = "(" + ", ".join("?" * (len(fields) + 1)) + ")"
+            for start in range(0, len(rows), UPDATE_ROWS_PER_STATEMENT):
+                chunk = rows[start:start + UPDATE_ROWS_PER_STATEMENT]
+                values = ", ".join([row_placeholders] * len(chunk))
+                params = [value for row in chunk for value in row]
+                updated_ids.extend(row[0] for row in conn.execute(
+                    f"WITH changes({columns}) AS (VALUES {values}) "
+                    f"UPDATE students SET {assignments} FROM changes WHERE students.id = changes.id "
+                    f"RETURNING students.id", params))
+    profile_cache.invalidate_students(database_key(conn), updated_ids)
+    return updated_ids
+
+# Delete a student; their enrollments are removed by ON DELETE CASCADE.
+# Returns False when no student has this ID.
+def remove_student(conn, student_id):
+    with transaction(conn):
+        deleted = conn.execute("DELETE FROM students WHERE id = ?", (student_id,)).rowcount
+    profile_cache.invalidate_students(database_key(conn), [student_id])
+    return deleted > 0
+
+# Delete every student matching all of the given criteria (an ID list, a grade and/or an
+# enrollment date range, both ends inclusive) in one transaction. Returns the number deleted.
+def delete_students(conn, ids=None, grade=None, enrolled_from=None, enrolled_to=None):
+    if ids is None and grade is None and enrolled_from is None and enrolled_to is None:
+        raise ValueError("Give at least one of: student IDs, grade, enrollment date range.")
+    conditions = []
+    params = []
+    if grade is not None:
+        conditions.append("grade = ?")
+        params.append(validate_grade(grade))
+    if enrolled_from is not None:
+        enrolled_from = validate_enrollement_date(enrolled_from)
+        conditions.append("enrollement_date >= ?")
+        params.append(enrolled_from)
+    if enrolled_to is not None:
+        enrolled_to = validate_enrollement_date(enrolled_to)
+        conditions.append("enrollement_date <= ?")
+        params.append(enrolled_to)
+
+    deleted_ids = []
+    with transaction(conn):
+        if ids is None:
+            deleted_ids.extend(row[0] for row in conn.execute(
+                f"DELETE FROM students WHERE {' AND '.join(conditions)} RETURNING id", params))
+        else:
+            ids = list(ids)
+            for start in range(0, len(ids), ID_LOOKUP_CHUNK_SIZE):
+                chunk = ids[start:start + ID_LOOKUP_CHUNK_SIZE]
+                where = " AND ".join([f"id IN ({', '.join('?' * len(chunk))})"] + conditions)
+                deleted_ids.extend(row[0] for row in conn.execute(
+                    f"DELETE FROM students WHERE {where} RETURNING id", chunk + params))
+
+    profile_cache.invalidate_students(database_key(conn), deleted_ids)
+    return len(deleted_ids)
+
+# Enroll a student in the given lessons in one transaction (see enroll_students for the result)
+def enroll_student(conn, student_id, lesson_ids):
+    return enroll_students(conn, [(student_id, lesson_id) for lesson_id in lesson_ids])
+
+# Return the subset of ids that belong to existing students, looked up in chunks that stay
+# below SQLite's limit on bound parameters
+ID_LOOKUP_CHUNK_SIZE = 500
+
+def fetch_existing_student_ids(conn, ids):
+    ids = list(ids)
+    existing_ids = set()
+    for start in range(0, len(ids), ID_LOOKUP_CHUNK_SIZE):
+        chunk = ids[start:start + ID_LOOKUP_CHUNK_SIZE]
+        placeholders = ", ".join("?" * len(chunk))
+        existing_ids.update(row[0] for row in conn.execute(
+            f"SELECT id FROM students WHERE id IN ({placeholders})", chunk))
+    return existing_ids
+
+# Enroll many (student_id, lesson_id) pairs in one transaction. Pairs are checked against hash
+# sets of the existing students and lessons; pairs that are already enrolled (or repeated in
+# the input) are skipped by INSERT OR IGNORE.
+# Returns {"inserted": n, "skipped": n, "invalid": [pairs with an unknown student or lesson]}.
+def enroll_students(conn, pairs):
+    pairs = list(pairs)
+    lesson_ids = get_lesson_catalog(conn).names_by_id
+    student_ids = fetch_existing_student_ids(conn, {student_id for student_id, _ in pairs})
+
+    valid_pairs = []
+    invalid_pairs = []
+    for pair in pairs:
+        if pair[0] in student_ids and pair[1] in lesson_ids:
+            valid_pairs.append(pair)
+        else:
+            invalid_pairs.append(pair)
+
+    with transaction(conn):
+        inserted = conn.executemany("INSERT OR IGNORE INTO student_lessons (student_id, lesson_id) VALUES (?, ?)",
+                                    valid_pairs).rowcount if valid_pairs else 0
+    if inserted:
+        profile_cache.invalidate_students(database_key(conn), {student_id for student_id, _ in valid_pairs})
+    return {"inserted": inserted, "skipped": len(valid_pairs) - inserted, "invalid": invalid_pairs}
+
+# Enroll every student of a grade in the given lessons with one INSERT ... SELECT statement,
+# e.g. enroll_cohort(conn, 10, [3, 5, 7]). Unknown lesson IDs are reported in "invalid".
+def enroll_cohort(conn, grade, lesson_ids):
+    lesson_ids = list(dict.fromkeys(lesson_ids))
+    known_lessons = get_lesson_catalog(conn).names_by_id
+    valid_lessons = [lesson_id for lesson_id in lesson_ids if lesson_id in known_lessons]
+    invalid_lessons = [lesson_id for lesson_id in lesson_ids if lesson_id not in known_lessons]
+    if not valid_lessons:
+        return {"inserted": 0, "skipped": 0, "invalid": invalid_lessons}
+
+    placeholders = ", ".join("?" * len(valid_lessons))
+    with transaction(conn):
+        cohort_size = conn.execute("SELECT COUNT(*) FROM students WHERE grade = ?", (grade,)).fetchone()[0]
+        inserted = conn.execute(f"""
+            INSERT OR IGNORE INTO student_lessons (student_id, lesson_id)
+            SELECT students.id, lessons.id
+            FROM students
+            JOIN lessons ON lessons.id IN ({placeholders})
+            WHERE students.grade = ?
+            """, (*valid_lessons, grade)).rowcount
+    if inserted:
+        profile_cache.invalidate(database_key(conn), lambda profile: profile.grade == grade)
+    return {"inserted": inserted, "skipped": cohort_size * len(valid_lessons) - inserted, "invalid": invalid_lessons}
+
+## Lessons
+def validate_lesson_name(name):
+    name = str(name).strip()
+    if not name:
+        raise ValueError("Lesson name cannot be empty.")
+    if name.isdigit():
+        raise ValueError("Lesson name cannot be purely numeric.")
+    return name
+
+# The lessons table is small and rarely changes, so every connection keeps it in memory as
+# id -> name and name -> id dictionaries, loaded on first use. The lesson functions below update
+# the catalog in place after they commit. PRAGMA data_version changes whenever another
+# connection, in this process or another one, commits; the catalog is then loaded again.
+class LessonCatalog:
+    def __init__(self, rows, data_version):
+        self.names_by_id = dict(rows)
+        self.ids_by_name = {name: id for id, name in rows}
+        self.data_version = data_version
+
+    # Record a committed change: a new or renamed lesson, or a deleted one (name=None)
+    def update(self, lesson_id, name):
+        old_name = self.names_by_id.get(lesson_id)
+        if old_name is not None:
+            del self.ids_by_name[old_name]
+        if name is None:
+            self.names_by_id.pop(lesson_id, None)
+        else:
+            self.names_by_id[lesson_id] = name
+            self.ids_by_name[name] = lesson_id
+
+# The up-to-date lesson catalog of a connection. Connections not made by connect() have nowhere
+# to keep it, so they get a freshly loaded one every time.
+def get_lesson_catalog(conn):
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    catalog = getattr(conn, "lesson_catalog", None)
+    if catalog is None or catalog.data_version != data_version:
+        catalog = LessonCatalog(conn.execute("SELECT id, name FROM lessons ORDER BY id").fetchall(), data_version)
+        if hasattr(conn, "lesson_catalog"):
+            conn.lesson_catalog = catalog
+    return catalog
+
+# Apply a lesson change made on conn to its catalog. Changes made inside a larger transaction
+# (a batch) may still be rolled back, so the catalog is dropped instead and loaded again later.
+def lesson_catalog_changed(conn, lesson_id, name):
+    catalog = getattr(conn, "lesson_catalog", None)
+    if catalog is None:
+        return
+    if conn.in_transaction:
+        conn.lesson_catalog = None
+    else:
+        catalog.update(lesson_id, name)
+
+# Forget the catalog of conn, e.g. after rolling back a transaction that changed lessons.
+# Rollbacks and restores on the same connection do not change its data_version.
+def invalidate_lesson_catalog(conn):
+    if getattr(conn, "lesson_catalog", None) is not None:
+        conn.lesson_catalog = None
+
+# All lessons as (id, name) pairs ordered by ID
+def fetch_lessons(conn):
+    return list(get_lesson_catalog(conn).names_by_id.items())
+
+def lesson_exists(conn, lesson_id):
+    return lesson_id in get_lesson_catalog(conn).names_by_id
+
+# Check whether a lesson other than except_id already uses this name
+def lesson_name_taken(conn, name, except_id=None):
+    owner = get_lesson_catalog(conn).ids_by_name.get(name)
+    return owner is not None and owner != except_id
+
+# Add a lesson and return its ID
+def insert_lesson(conn, name):
+    name = validate_lesson_name(name)
+    if lesson_name_taken(conn, name):
+        raise ValueError("This lesson already exists.")
+    with transaction(conn):
+        lesson_id = conn.execute("INSERT INTO lessons (name) VALUES (?)", (name,)).lastrowid
+    lesson_catalog_changed(conn, lesson_id, name)
+    return lesson_id
+
+# Rename a lesson. Returns False when no lesson has this ID.
+def rename_lesson(conn, lesson_id, name):
+    name = validate_lesson_name(name)
+    if lesson_name_taken(conn, name, lesson_id):
+        raise ValueError("This lesson already exists.")
+    with transaction(conn):
+        renamed = conn.execute("UPDATE lessons SET name = ? WHERE id = ?", (name, lesson_id)).rowcount
+    if renamed:
+        lesson_catalog_changed(conn, lesson_id, name)
+    profile_cache.invalidate_lesson(database_key(conn), lesson_id)
+    return renamed > 0
+
+# Delete a lesson; enrollments in it are removed by ON DELETE CASCADE.
+# Returns False when no lesson has this ID.
+def remove_lesson(conn, lesson_id):
+    with transaction(conn):
+        deleted = conn.execute("DELETE FROM lessons WHERE id = ?", (lesson_id,)).rowcount
+    lesson_catalog_changed(conn, lesson_id, None)
+    profile_cache.invalidate_lesson(database_key(conn), lesson_id)
+    return deleted > 0
+
+## Student profiles
+# Everything display_student shows about a student, as one compact immutable record.
+# The dates are day numbers, as stored; print_student_profile shows them as YYYY-MM-DD.
+StudentProfile = namedtuple("StudentProfile", [
+    "id", "first_name", "last_name", "age", "grade", "enrollement_date", "data_entry_date",
+    "lessons", "lesson_ids",
+])
+
+class ProfileCache:
+    # Bounded LRU cache of StudentProfile records keyed by (database, student_id).
+    # The functions that change students, enrollments or lesson names invalidate exactly the
+    # profiles they affect, after their transaction has committed. Commits made by any other
+    # connection are noticed by get_student_profile() through PRAGMA data_version, and drop
+    # every profile of that database. A profile read from the database while an invalidation
+    # happens is not stored, so a reader can never put back data that was just changed.
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0  # bumped on every invalidation
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            profile = self.entries.get(key)
+            if profile is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return profile
+
+    # Store a profile that was read while the cache was at the given generation
+    def put(self, key, profile, generation):
+        with self.lock:
+            if generation != self.generation or self.maxsize < 1:
+                return
+            self.entries[key] = profile
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    # Drop the cached profiles of one database for which predicate(profile) is true
+    def invalidate(self, database, predicate):
+        with self.lock:
+            self.generation += 1
+            for key in [key for key, profile in self.entries.items() if key[0] == database and predicate(profile)]:
+                del self.entries[key]
+
+    def invalidate_students(self, database, student_ids):
+        with self.lock:
+            self.generation += 1
+            for student_id in student_ids:
+                self.entries.pop((database, student_id), None)
+
+    def invalidate_lesson(self, database, lesson_id):
+        self.invalidate(database, lambda profile: lesson_id in profile.lesson_ids)
+
+    def invalidate_database(self, database):
+        self.invalidate(database, lambda profile: True)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "maxsize": self.maxsize,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
+
+profile_cache = ProfileCache()
+
+# The student row followed by a JSON array of [lesson_id, lesson_name] pairs
+STUDENT_PROFILE_QUERY = """
+    SELECT students.*, json_group_array(json_array(lessons.id, lessons.name)) FILTER (WHERE lessons.id IS NOT NULL)
+    FROM students
+    LEFT JOIN student_lessons ON student_lessons.student_id = students.id
+    LEFT JOIN lessons ON lessons.id = student_lessons.lesson_id
+    WHERE students.id = ?
+    GROUP BY students.id
+    """
+
+# Drop the cached profiles of the database of conn when another connection has committed
+# since conn last looked. The first check on a connection cannot tell what other connections
+# committed before it, so it drops them as well.
+def check_profile_data_version(conn):
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if conn.profile_data_version != data_version:
+        profile_cache.invalidate_database(database_key(conn))
+        conn.profile_data_version = data_version
+
+# Fetch a student and their lessons with one query, through the profile cache.
+# Returns a StudentProfile, or None when no student has this ID.
+# Connections not made by connect() have nowhere to keep their data_version and always read
+# the database.
+def get_student_profile(conn, student_id):
+    if not hasattr(conn, "profile_data_version"):
+        row = conn.execute(STUDENT_PROFILE_QUERY, (student_id,)).fetchone()
+        return None if row is None else student_profile_from_row(row)
+
+    key = (database_key(conn), student_id)
+    check_profile_data_version(conn)
+    profile = profile_cache.get(key)
+    if profile is not None:
+        return profile
+
+    generation = profile_cache.generation
+    row = conn.execute(STUDENT_PROFILE_QUERY, (student_id,)).fetchone()
+    if row is None:
+        return None
+    profile = student_profile_from_row(row)
+    profile_cache.put(key, profile, generation)
+    return profile
+
+# Build a StudentProfile from a row of STUDENT_PROFILE_QUERY
+def student_profile_from_row(row):
+    lessons = json.loads(row[7])
+    return StudentProfile(*row[:7], tuple(lesson[1] for lesson in lessons), tuple(lesson[0] for lesson in lessons))
+
+## Search
+DEFAULT_SEARCH_LIMIT = 20
+
+# Turn free text into an FTS5 query: every word must match as a prefix of a name,
+# so "moh it" finds "Mohammed Itair". Returns None when there is nothing to search for.
+def build_search_query(text):
+    words = re.findall(r"\w+", str(text))
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+# Misspelled names: every search word of 3 or more letters is compared with the most similar
+# word of a name, and the name matches when these similarities average at least
+# FUZZY_MIN_SIMILARITY, so "mohamad itiar" finds "Mohammed Itair". The trigram index picks the
+# FUZZY_CANDIDATES_PER_RESULT * limit names sharing the most trigrams with the search words,
+# and those are ranked by their similarity in Python.
+FUZZY_MIN_SIMILARITY = 0.3
+FUZZY_CANDIDATES_PER_RESULT = 20
+
+# The trigrams of a word, padded like PostgreSQL's pg_trgm so the start and end of a word count more
+def word_trigrams(word):
+    padded = f"  {word.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# Similarity of two words between 0 and 1: the share of their trigrams they have in common
+def trigram_similarity(word, other):
+    trigrams = word_trigrams(word)
+    other_trigrams = word_trigrams(other)
+    return len(trigrams & other_trigrams) / len(trigrams | other_trigrams)
+
+# Rows of a trigram table (rowid first, then the name columns) that look like the search text,
+# most similar first
+def fuzzy_search(conn, table, columns, text, limit):
+    words = [word for word in re.findall(r"\w+", str(text)) if len(word) >= 3]
+    if not words:
+        return []
+    trigrams = {word[i:i + 3].lower() for word in words for i in range(len(word) - 2)}
+    query = " OR ".join(f'"{trigram}"' for trigram in sorted(trigrams))
+    candidates = conn.execute(f"SELECT rowid, {', '.join(columns)} FROM {table} WHERE {table} MATCH ? ORDER BY rank LIMIT ?",
+                              (query, limit * FUZZY_CANDIDATES_PER_RESULT)).fetchall()
+    matches = []
+    for row in candidates:
+        name_words = re.findall(r"\w+", " ".join(row[1:]))
+        similarities = [max(trigram_similarity(word, name_word) for name_word in name_words) for word in words]
+        similarity = sum(similarities) / len(similarities)
+        if similarity >= FUZZY_MIN_SIMILARITY:
+            matches.append((similarity, row))
+    matches.sort(key=lambda match: match[0], reverse=True)
+    return [row for _, row in matches[:limit]]
+
+# Students whose first or last name match the search text, best match first. When no name
+# starts with the search words, names that look like a misspelling of them are returned.
+# Returns [(id, first_name, last_name), ...]
+def search_students(conn, text, limit=DEFAULT_SEARCH_LIMIT):
+    query = build_search_query(text)
+    if query is None:
+        return []
+    students = conn.execute("SELECT rowid, first_name, last_name FROM students_fts WHERE students_fts MATCH ? ORDER BY rank LIMIT ?",
+                            (query, limit)).fetchall()
+    return students or fuzzy_search(conn, "students_trigram", ("first_name", "last_name"), text, limit)
+
+# Lessons whose name matches the search text, best match first, with the same fallback to
+# misspelled names as search_students. Returns [(id, name), ...]
+def search_lessons(conn, text, limit=DEFAULT_SEARCH_LIMIT):
+    query = build_search_query(text)
+    if query is None:
+        return []
+    lessons = conn.execute("SELECT rowid, name FROM lessons_fts WHERE lessons_fts MATCH ? ORDER BY rank LIMIT ?",
+                           (query, limit)).fetchall()
+    return lessons or fuzzy_search(conn, "lessons_trigram", ("name",), text, limit)
+
 ############################################## Student Functions ##############################################
 ## F1: Add Student
 def add_student():
+    conn = get_connection()
     while True:
         id_input = input("Enter student id: ").strip()
         if id_input == "":
@@ -41,8 +1339,7 @@ def add_student():
             print("Invalid input. Please enter a valid integer for the student ID.")
 
     # Check if student ID already exists
-    existing_id = conn.execute("SELECT id FROM students WHERE id = ?", (id,)).fetchone()
-    if existing_id:
+    if student_exists(conn, id):
         
         print("A student with this ID already exists. Please try again with a different ID.")
         return
@@ -85,14 +1382,6 @@ def add_student():
         except ValueError:
             print("Invalid input. Grade must be an integer between 1 and 12.")
 
-
-    def valid_date_format(date_input):
-        try:
-            datetime.strptime(date_input, '%Y-%m-%d')
-            return True
-        except ValueError:
-            return False
-        
     enrollement_date = input("Enter enrollement date (YYYY-MM-DD): ").strip()
     while not valid_date_format(enrollement_date):
         if enrollement_date == "":
@@ -101,16 +1390,13 @@ def add_student():
             print("Invalid date format. Please enter the date in YYYY-MM-DD format.")
         enrollement_date = input("Enter enrollment date (YYYY-MM-DD): ").strip()
 
-    data_entry_date = datetime.now().strftime('%Y-%m-%d')
-
-    conn.execute("INSERT INTO students (id, first_name, last_name, age, grade, enrollement_date, data_entry_date) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                 (id, first_name, last_name, age, grade, enrollement_date, data_entry_date))
-    conn.commit()
+    insert_student(conn, {"id": id, "first_name": first_name, "last_name": last_name, "age": age,
+                          "grade": grade, "enrollement_date": enrollement_date})
     print("Student added successfully!")
 
     # Assign lesson/s to the last added student
     # Check for the availability of lessons
-    lessons = conn.execute("SELECT id, name FROM lessons").fetchall()
+    lessons = fetch_lessons(conn)
     if not lessons:
         print("There are no available lessons now. Add a lesson first, then use the assign lesson function to assign lessons to the student you just added.")
         return  # Exit the function since there are no lessons to assign
@@ -119,6 +1405,7 @@ def add_student():
     for lesson in lessons:
         print(f"{lesson[0]}: {lesson[1]}")
 
+    lesson_ids = {lesson[0] for lesson in lessons}
     selected_lessons = []
     lesson_count = int(input("How many lessons is the student enrolled in? ").strip())
 
@@ -129,7 +1416,7 @@ def add_student():
                 break
             try:
                 lesson_id = int(lesson_id_input)
-                if lesson_id in [lesson[0] for lesson in lessons]:
+                if lesson_id in lesson_ids:
                     selected_lessons.append(lesson_id)
                     print(f"Lesson with ID {lesson_id} is selected.")
                     break
@@ -141,58 +1428,84 @@ def add_student():
         if lesson_id_input.lower() == 'done':
             break
 
-    for lesson_id in selected_lessons:
-        # Assign the lesson to the student
-        conn.execute("INSERT INTO student_lessons (student_id, lesson_id) VALUES (?, ?)", (id, lesson_id))
-        conn.commit()
-    print("Lessons assigned successfully.") 
+    # Assign the lessons to the student in one transaction
+    enroll_student(conn, id, list(dict.fromkeys(selected_lessons)))
+    print("Lessons assigned successfully.")
 
 ## F2 : list all students
-def list_students():
+def list_students(page_size=DEFAULT_PAGE_SIZE):
+    conn = get_connection()
     print("=== List of Students ===")
     try:
-        students = conn.execute("SELECT id, first_name, last_name FROM students ORDER BY id ASC").fetchall()
-        if students:
+        students = fetch_students_page(conn, None, page_size)
+        if not students:
+            print("No students found.")
+            return
+        page = 1
+        while True:
+            print(f"--- Page {page} ---")
             for student in students:
                 print(f"ID: {student[0]}, First Name: {student[1]}, Last Name: {student[2]}")
-        else:
-            print("No students found.")
+
+            has_next = len(students) == page_size and fetch_students_page(conn, students[-1][0], 1)
+            has_previous = page > 1
+            options = []
+            if has_next:
+                options.append("'n' for the next page")
+            if has_previous:
+                options.append("'p' for the previous page")
+            if not options:
+                return
+            choice = input(f"Press {', '.join(options)}, or anything else to go back: ").strip().lower()
+
+            if choice == 'n' and has_next:
+                students = fetch_students_page(conn, students[-1][0], page_size)
+                page += 1
+            elif choice == 'p' and has_previous:
+                students = fetch_students_page_before(conn, students[0][0], page_size)
+                page -= 1
+            else:
+                return
     except Exception as e:
         print(f"An error occurred: {e}")
 
 ## F3 : Display student info
 def display_student():
-    student_id = input("Enter student ID to display information: ")
-    student_info = conn.execute("SELECT * FROM students WHERE id = ?", (student_id,)).fetchone()
+    conn = get_connection()
+    student_id_input = input("Enter student ID to display information: ").strip()
+    try:
+        student_id = int(student_id_input)
+    except ValueError:
+        print("Invalid input. Please enter a valid integer for the student ID.")
+        return
+
+    # One query for the student and the enrolled lessons, served from the profile cache when possible
+    student_info = get_student_profile(conn, student_id)
     if student_info:
-        print("Student ID:", student_info[0])
-        print("First Name:", student_info[1])
-        print("Last Name:", student_info[2])
-        print("Age:", student_info[3])
-        print("Grade:", student_info[4])
-        print("Enrollement Date:", student_info[5])
-        print("Data Entry Date:", student_info[6])
-
-        # Fetch and display enrolled lessons
-        lessons = conn.execute("""
-            SELECT lessons.name 
-            FROM lessons
-            JOIN student_lessons ON lessons.id = student_lessons.lesson_id
-            WHERE student_lessons.student_id = ?
-            """, (student_id,)).fetchall()
-        
-        if lessons:
-            print("Enrolled Lessons:")
-            for lesson in lessons:
-                print("- ", lesson[0])
-        else:
-            print("No lessons enrolled for this student.")
+        print_student_profile(student_info)
     else:
         
         print("Student not found!")
 
+def print_student_profile(student_info):
+    print("Student ID:", student_info.id)
+    print("First Name:", student_info.first_name)
+    print("Last Name:", student_info.last_name)
+    print("Age:", student_info.age)
+    print("Grade:", student_info.grade)
+    print("Enrollement Date:", day_to_date(student_info.enrollement_date))
+    print("Data Entry Date:", day_to_date(student_info.data_entry_date))
+
+    if student_info.lessons:
+        print("Enrolled Lessons:")
+        for lesson in student_info.lessons:
+            print("- ", lesson)
+    else:
+        print("No lessons enrolled for this student.")
+
 ## F4: Modify student   
 def modify_student():
+    conn = get_connection()
     student_id_input = input("Enter student ID to modify: ").strip()
     try:
         student_id = int(student_id_input)
@@ -200,12 +1513,6 @@ def modify_student():
         print("Invalid input. Please enter a valid integer for the student ID.")
         return
     
-    # Check if student exists
-    check = conn.execute("SELECT COUNT(*) FROM students WHERE id = ?", (student_id,)).fetchone()
-    if check[0] == 0:
-        print("Student not found!")
-        return
-
     new_first_name = input("Enter new first name (press Enter to skip): ").strip()
     while any(char.isdigit() for char in new_first_name) and new_first_name:
         print("First name cannot contain numbers. Please enter again.")
@@ -239,20 +1546,25 @@ def modify_student():
             print("Invalid input. Grade must be a number.")
             return
 
+    changes = {}
     if new_first_name:
-        conn.execute("UPDATE students SET first_name = ? WHERE id = ?", (new_first_name, student_id))
+        changes["first_name"] = new_first_name
     if new_last_name:
-        conn.execute("UPDATE students SET last_name = ? WHERE id = ?", (new_last_name, student_id))
+        changes["last_name"] = new_last_name
     if new_age:
-        conn.execute("UPDATE students SET age = ? WHERE id = ?", (new_age, student_id))
+        changes["age"] = new_age
     if new_grade:
-        conn.execute("UPDATE students SET grade = ? WHERE id = ?", (new_grade, student_id))
+        changes["grade"] = new_grade
 
-    conn.commit()
+    # The existence check comes from the update itself
+    if update_student(conn, student_id, changes) is None:
+        print("Student not found!")
+        return
     print("Student information modified successfully!")
 
 ## F5: Delete student   
 def delete_student():
+    conn = get_connection()
     student_id_input = input("Enter student ID to delete: ").strip()
     try:
         student_id = int(student_id_input)  # Convert input to integer
@@ -261,24 +1573,47 @@ def delete_student():
         return  # Exit the function if input is not a valid integer
 
     # Check if the student exists before attempting to delete
-    existing_student = conn.execute("SELECT id FROM students WHERE id = ?", (student_id,)).fetchone()
-    if not existing_student:
+    if not student_exists(conn, student_id):
         print("No student found with the provided ID.")
         return  # Exit the function if no student is found
 
     # Ask for confirmation before deleting
     confirmation = input("Are you sure you want to delete this student and all his/her related lessons? (yes/no): ").strip().lower()
     if confirmation == 'yes':
-        conn.execute("DELETE FROM students WHERE id = ?", (student_id,))
-        conn.execute("DELETE FROM student_lessons WHERE student_id = ?", (student_id,))
-        conn.commit()
+        remove_student(conn, student_id)
         print("Student and his/her related lessons deleted successfully!!")
     else:
         print("Student deletion cancelled.")
 
+## F6: Search students and lessons by name
+def search_by_name(text=None, limit=DEFAULT_SEARCH_LIMIT):
+    conn = get_connection()
+    if text is None:
+        text = input("Enter (part of) a student or lesson name to search for: ").strip()
+    if build_search_query(text) is None:
+        print("Please enter at least one letter or digit to search for.")
+        return
+
+    students = search_students(conn, text, limit)
+    if students:
+        print("Matching students:")
+        for student in students:
+            print(f"ID: {student[0]}, First Name: {student[1]}, Last Name: {student[2]}")
+    else:
+        print("No matching students found.")
+
+    lessons = search_lessons(conn, text, limit)
+    if lessons:
+        print("Matching lessons:")
+        for lesson in lessons:
+            print(f"ID: {lesson[0]}, Name: {lesson[1]}")
+    else:
+        print("No matching lessons found.")
+
 ############################################## Lesson Functions ##############################################
 ## F1: Add lesson
 def add_lesson():
+    conn = get_connection()
     display_lessons()
     while True:
         lesson_name = input("Enter the new lesson name: ").strip()
@@ -291,18 +1626,17 @@ def add_lesson():
             break  # Proceed if name is valid
 
     # Check for lesson name uniqueness
-    existing_lesson = conn.execute("SELECT name FROM lessons WHERE name = ?", (lesson_name,)).fetchone()
-    if existing_lesson:
+    if lesson_name_taken(conn, lesson_name):
         print("This lesson already exists.")
         return
-    conn.execute("INSERT INTO lessons (name) VALUES (?)", (lesson_name,))
-    conn.commit()
+    insert_lesson(conn, lesson_name)
     print("Lesson added successfully.")
 
 ## F2: Display lesson
 def display_lessons():
+    conn = get_connection()
     print("Available Lessons:")
-    lessons = conn.execute("SELECT id, name FROM lessons").fetchall()
+    lessons = fetch_lessons(conn)
     if not lessons:
         print("No lessons available.")
         return
@@ -311,6 +1645,7 @@ def display_lessons():
 
 ## F3: Modify lesson
 def modify_lesson():
+    conn = get_connection()
     display_lessons() 
     lesson_id_input = input("Enter the lesson ID to modify: ").strip()
     try:
@@ -320,8 +1655,7 @@ def modify_lesson():
         return
 
     # Check if the lesson exists
-    existing_lesson = conn.execute("SELECT id FROM lessons WHERE id = ?", (lesson_id,)).fetchone()
-    if not existing_lesson:
+    if not lesson_exists(conn, lesson_id):
         print("This lesson does not exist.")
         return
 
@@ -335,15 +1669,20 @@ def modify_lesson():
             continue
         break
 
-    conn.execute("UPDATE lessons SET name = ? WHERE id = ?", (new_name, lesson_id))
-    conn.commit()
+    # Check for lesson name uniqueness
+    if lesson_name_taken(conn, new_name, lesson_id):
+        print("This lesson already exists.")
+        return
+
+    rename_lesson(conn, lesson_id, new_name)
     print("Lesson modified successfully.")
 
 ## F4: Assign lesson
 def assign_lessons():
+    conn = get_connection()
     # Display all available lessons
     print("Select lessons to enroll the student in. Available lessons are:")
-    lessons = conn.execute("SELECT id, name FROM lessons").fetchall()
+    lessons = fetch_lessons(conn)
     for lesson in lessons:
         print(f"{lesson[0]}: {lesson[1]}")
 
@@ -356,24 +1695,27 @@ def assign_lessons():
         return
 
     # Check if the student exists in the database
-    check = conn.execute("SELECT COUNT(*) FROM students WHERE id = ?", (student_id,)).fetchone()
-    if check[0] == 0:
+    if not student_exists(conn, student_id):
         print("Student not found!")
         return
 
     # Display lessons the student is already enrolled in
-    enrolled_lessons = conn.execute("SELECT lessons.id FROM student_lessons JOIN lessons ON student_lessons.lesson_id = lessons.id WHERE student_lessons.student_id = ?", (student_id,)).fetchall()
-    enrolled_lesson_ids = [lesson[0] for lesson in enrolled_lessons]
-    if enrolled_lessons:
+    enrolled_lesson_ids = fetch_enrolled_lesson_ids(conn, student_id)
+    if enrolled_lesson_ids:
         print("This student is currently enrolled in the following lessons:")
         for lesson_id in enrolled_lesson_ids:
             print(f"Lesson ID: {lesson_id}")
     else:
         print("This student is not enrolled in any lessons.")
 
+    # Sets make the checks below constant time instead of a list scan per prompt
+    lesson_ids = {lesson[0] for lesson in lessons}
+    enrolled_lesson_ids = set(enrolled_lesson_ids)
+
     # Ask how many additional lessons the student is to be enrolled in
     lesson_count = int(input("How many additional lessons is the student to be enrolled in? "))
     enrolled_count = 0  # Track the number of successfully enrolled lessons
+    new_lesson_ids = []
     while enrolled_count < lesson_count:
         lesson_id_input = input("Enter the ID of the lesson to assign to the student, or type 'done' to finish: ").strip()
         if lesson_id_input.lower() == 'done' or not lesson_id_input:
@@ -385,7 +1727,7 @@ def assign_lessons():
 
         try:
             lesson_id = int(lesson_id_input)
-            if lesson_id not in [lesson[0] for lesson in lessons]:
+            if lesson_id not in lesson_ids:
                 print("Invalid lesson ID. Please select a valid ID from the list.")
                 continue
 
@@ -393,20 +1735,20 @@ def assign_lessons():
                 print(f"Student is already enrolled in lesson with ID {lesson_id}.")
                 continue
 
-            # Insert the new lesson for the student in the database
-            conn.execute("INSERT INTO student_lessons (student_id, lesson_id) VALUES (?, ?)", (student_id, lesson_id))
+            new_lesson_ids.append(lesson_id)
             print(f"Lesson with ID {lesson_id} is selected.")
-            enrolled_lesson_ids.append(lesson_id)  # Update enrolled lessons to reflect current state
+            enrolled_lesson_ids.add(lesson_id)  # Update enrolled lessons to reflect current state
             enrolled_count += 1  # Only increment count for successful enrollments
         except ValueError:
             print("Please enter a valid numeric ID.")
 
-    # Commit the changes to the database
-    conn.commit()
+    # Insert the new lessons for the student in one transaction
+    enroll_student(conn, student_id, new_lesson_ids)
     print("Lessons assigned successfully.")
 
 ## F5: Delete lesson
 def delete_lesson():
+    conn = get_connection()
     display_lessons()
     lesson_id = input("Enter the lesson ID to delete: ").strip()
     try:
@@ -416,54 +1758,1254 @@ def delete_lesson():
         return
 
     # Check if the lesson exists
-    existing_lesson = conn.execute("SELECT id FROM lessons WHERE id = ?", (lesson_id,)).fetchone()
-    if not existing_lesson:
+    if not lesson_exists(conn, lesson_id):
         print("This lesson does not exist.")
         return
     
     # Ask for confirmation before deleting
     confirmation = input("Are you sure you want to delete this lesson? (yes/no): ").strip().lower()
     if confirmation == 'yes':
-        conn.execute("DELETE FROM lessons WHERE id = ?", (lesson_id,))
-        conn.commit()
+        remove_lesson(conn, lesson_id)
         print("Lesson deleted successfully.")
     else:
         print("Lesson deletion cancelled.")
 
+############################################## Service Layer ##############################################
+# Thread-safe access to the data access functions for several terminals or a local HTTP
+# front end served from one process. Writes go through a single writer connection, reads
+# through a bounded set of read-only connections; in WAL mode readers never wait for the writer.
+
+BUSY_RETRIES = 5
+BUSY_RETRY_DELAY = 0.05  # seconds, doubled after every attempt
+
+# Check whether an error means another connection is holding the lock (SQLITE_BUSY / SQLITE_LOCKED)
+def is_busy_error(error):
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    error_name = getattr(error, "sqlite_errorname", "") or ""
+    return error_name.startswith(("SQLITE_BUSY", "SQLITE_LOCKED")) or "locked" in str(error) or "busy" in str(error)
+
+# Call function(), retrying with exponential backoff while the database is busy
+def run_with_retry(function, retries=BUSY_RETRIES, delay=BUSY_RETRY_DELAY):
+    for attempt in range(retries + 1):
+        try:
+            return function()
+        except sqlite3.OperationalError as e:
+            if attempt == retries or not is_busy_error(e):
+                raise
+            time.sleep(delay * 2 ** attempt)
+
+class ConnectionPool:
+    # One writer connection shared under a lock and up to max_readers read-only connections,
+    # opened on demand. Borrowing a connection blocks for at most timeout seconds.
+    def __init__(self, path=DATABASE_PATH, profile=DEFAULT_PROFILE, max_readers=4, timeout=30):
+        if profile not in CONNECTION_PROFILES:
+            raise ValueError(f"Unknown connection profile '{profile}'. Choose one of: {', '.join(CONNECTION_PROFILES)}.")
+        if CONNECTION_PROFILES[profile]['journal_mode'] != 'WAL':
+            raise ValueError("The connection pool needs a WAL profile so that reads are not serialized behind writes.")
+        if max_readers < 1:
+            raise ValueError("The connection pool needs at least one reader.")
+        self.path = path
+        self.profile = profile
+        self.max_readers = max_readers
+        self.timeout = timeout
+        self.writer_connection = connect(path, profile, check_same_thread=False)
+        self.writer_lock = threading.Lock()
+        self.reader_slots = threading.BoundedSemaphore(max_readers)
+        self.idle_readers = queue.LifoQueue()
+        self.reader_connections = []
+        self.readers_lock = threading.Lock()
+
+    def open_reader(self):
+        connection = connect(self.path, self.profile, check_same_thread=False)
+        connection.execute("PRAGMA query_only = ON")
+        with self.readers_lock:
+            self.reader_connections.append(connection)
+        return connection
+
+    # Borrow a read-only connection: with pool.reader() as conn: ...
+    @contextmanager
+    def reader(self):
+        if not self.reader_slots.acquire(timeout=self.timeout):
+            raise TimeoutError("No database reader connection became available.")
+        try:
+            try:
+                with self.readers_lock:
+                    connection = self.idle_readers.get_nowait()
+            except queue.Empty:
+                connection = self.open_reader()
+            try:
+                yield connection
+            finally:
+                if connection.in_transaction:
+                    connection.rollback()
+                self.idle_readers.put(connection)
+        finally:
+            self.reader_slots.release()
+
+    # Borrow the writer connection, one thread at a time: with pool.writer() as conn: ...
+    @contextmanager
+    def writer(self):
+        if not self.writer_lock.acquire(timeout=self.timeout):
+            raise TimeoutError("The database writer connection did not become available.")
+        try:
+            yield self.writer_connection
+        finally:
+            if self.writer_connection.in_transaction:
+                self.writer_connection.rollback()
+            try:
+                self.note_writer_commits()
+            finally:
+                self.writer_lock.release()
+
+    # The write functions invalidate exactly the cached profiles they change, so commits of the
+    # writer must not make the readers drop every profile (see check_profile_data_version).
+    # Idle readers take the data_version that includes them; then the writer checks its own
+    # data_version, which only changes for commits of other connections, so a commit from
+    # outside the pool that a reader skipped this way is noticed as well. Readers that are in
+    # use keep their old data_version and drop the profiles on their next lookup.
+    def note_writer_commits(self):
+        with self.readers_lock:
+            for connection in list(self.idle_readers.queue):
+                connection.profile_data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+        check_profile_data_version(self.writer_connection)
+
+    def close(self):
+        with self.writer_lock:
+            self.writer_connection.close()
+        with self.readers_lock:
+            for connection in self.reader_connections:
+                connection.close()
+            self.reader_connections.clear()
+
+class SchoolService:
+    # The school operations without input()/print(), safe to call from several threads at once
+    def __init__(self, path=DATABASE_PATH, profile=DEFAULT_PROFILE, max_readers=4):
+        self.pool = ConnectionPool(path, profile, max_readers)
+        self.write(create_tables)
+
+    # Run function(conn, *args) on a reader connection
+    def read(self, function, *args):
+        def attempt():
+            with self.pool.reader() as conn:
+                return function(conn, *args)
+        return run_with_retry(attempt)
+
+    # Run function(conn, *args) on the writer connection
+    def write(self, function, *args):
+        def attempt():
+            with self.pool.writer() as conn:
+                return function(conn, *args)
+        return run_with_retry(attempt)
+
+    ## Students
+    def add_student(self, record):
+        return self.write(insert_student, record)
+
+    def list_students(self, after_id=None, page_size=DEFAULT_PAGE_SIZE):
+        return self.read(fetch_students_page, after_id, page_size)
+
+    # Returns a StudentProfile, or None when no student has this ID
+    def get_student(self, student_id):
+        return self.read(get_student_profile, student_id)
+
+    def cache_stats(self):
+        return profile_cache.stats()
+
+    def update_student(self, student_id, changes):
+        return self.write(update_student, student_id, changes)
+
+    def update_students(self, updates):
+        return self.write(update_students, updates)
+
+    def delete_student(self, student_id):
+        return self.write(remove_student, student_id)
+
+    def delete_students(self, ids=None, grade=None, enrolled_from=None, enrolled_to=None):
+        return self.write(delete_students, ids, grade, enrolled_from, enrolled_to)
+
+    def search_students(self, text, limit=DEFAULT_SEARCH_LIMIT):
+        return self.read(search_students, text, limit)
+
+    ## Lessons
+    def add_lesson(self, name):
+        return self.write(insert_lesson, name)
+
+    def search_lessons(self, text, limit=DEFAULT_SEARCH_LIMIT):
+        return self.read(search_lessons, text, limit)
+
+    def list_lessons(self):
+        return self.read(fetch_lessons)
+
+    def rename_lesson(self, lesson_id, name):
+        return self.write(rename_lesson, lesson_id, name)
+
+    def assign_lessons(self, student_id, lesson_ids):
+        return self.write(enroll_student, student_id, lesson_ids)
+
+    def enroll_students(self, pairs):
+        return self.write(enroll_students, pairs)
+
+    def enroll_cohort(self, grade, lesson_ids):
+        return self.write(enroll_cohort, grade, lesson_ids)
+
+    def delete_lesson(self, lesson_id):
+        return self.write(remove_lesson, lesson_id)
+
+    def close(self):
+        self.pool.close()
+
+class AsyncSchoolService:
+    # asyncio facade over SchoolService: every call runs on a thread pool, so the event loop
+    # is never blocked by SQLite and reads on different threads run in parallel.
+    def __init__(self, service, max_workers=None):
+        self.service = service
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or service.pool.max_readers + 1)
+
+    async def run(self, method, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(method, *args))
+
+    ## Students
+    async def add_student(self, record):
+        return await self.run(self.service.add_student, record)
+
+    async def list_students(self, after_id=None, page_size=DEFAULT_PAGE_SIZE):
+        return await self.run(self.service.list_students, after_id, page_size)
+
+    async def get_student(self, student_id):
+        return await self.run(self.service.get_student, student_id)
+
+    async def update_student(self, student_id, changes):
+        return await self.run(self.service.update_student, student_id, changes)
+
+    async def update_students(self, updates):
+        return await self.run(self.service.update_students, updates)
+
+    async def delete_student(self, student_id):
+        return await self.run(self.service.delete_student, student_id)
+
+    async def delete_students(self, ids=None, grade=None, enrolled_from=None, enrolled_to=None):
+        return await self.run(self.service.delete_students, ids, grade, enrolled_from, enrolled_to)
+
+    async def search_students(self, text, limit=DEFAULT_SEARCH_LIMIT):
+        return await self.run(self.service.search_students, text, limit)
+
+    ## Lessons
+    async def add_lesson(self, name):
+        return await self.run(self.service.add_lesson, name)
+
+    async def search_lessons(self, text, limit=DEFAULT_SEARCH_LIMIT):
+        return await self.run(self.service.search_lessons, text, limit)
+
+    async def list_lessons(self):
+        return await self.run(self.service.list_lessons)
+
+    async def rename_lesson(self, lesson_id, name):
+        return await self.run(self.service.rename_lesson, lesson_id, name)
+
+    async def assign_lessons(self, student_id, lesson_ids):
+        return await self.run(self.service.assign_lessons, student_id, lesson_ids)
+
+    async def enroll_students(self, pairs):
+        return await self.run(self.service.enroll_students, pairs)
+
+    async def enroll_cohort(self, grade, lesson_ids):
+        return await self.run(self.service.enroll_cohort, grade, lesson_ids)
+
+    async def delete_lesson(self, lesson_id):
+        return await self.run(self.service.delete_lesson, lesson_id)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.service.close()
+
+############################################## Bulk Import ##############################################
+# Stream (line_number, record) pairs from a CSV or JSONL file without loading it into memory.
+# Lines that are not valid JSON are yielded as raw strings so they end up in the reject file.
+def read_import_file(path):
+    # utf-8-sig skips the byte order mark that e.g. Excel writes at the start of "CSV UTF-8" files
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        if path.lower().endswith(('.jsonl', '.json')):
+            for line_no, line in enumerate(file, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError:
+                    yield line_no, line
+        else:
+            reader = csv.DictReader(file)
+            for record in reader:
+                yield reader.line_num, record
+
+# Non-interactive counterpart of add_student: validate every record of the file and insert
+# the valid ones with executemany, one transaction per batch_size rows.
+# Invalid records are written to reject_path together with the reason they failed.
+def import_students(conn, path, batch_size=1000, reject_path=None):
+    if batch_size < 1:
+        raise ValueError("Batch size must be at least 1.")
+    if reject_path is None:
+        reject_path = path + ".rejects.csv"
+
+    lesson_ids = get_lesson_catalog(conn).names_by_id
+    data_entry_date = day_number(date.today())
+    seen_ids = set()
+    batch = []
+    stats = {"read": 0, "imported": 0, "enrollments": 0, "rejected": 0}
+    reject_file = None
+    reject_writer = None
+
+    def reject(line_no, reason, record):
+        nonlocal reject_file, reject_writer
+        if reject_writer is None:
+            # The reject file is only created once there is something to put in it
+            reject_file = open(reject_path, 'w', newline='', encoding='utf-8')
+            reject_writer = csv.writer(reject_file)
+            reject_writer.writerow(["line", "reason", "record"])
+        raw = record if isinstance(record, str) else json.dumps(record, ensure_ascii=False)
+        reject_writer.writerow([line_no, reason, raw])
+        stats["rejected"] += 1
+
+    def flush():
+        if not batch:
+            return
+        # One indexed lookup per batch instead of one per row
+        existing_ids = fetch_existing_student_ids(conn, [student[0] for _, _, student, _ in batch])
+
+        student_rows = []
+        lesson_rows = []
+        for line_no, record, student, lessons in batch:
+            if student[0] in existing_ids:
+                reject(line_no, "A student with this ID already exists.", record)
+                continue
+            student_rows.append(student + (data_entry_date,))
+            lesson_rows.extend((student[0], lesson_id) for lesson_id in lessons)
+
+        with transaction(conn):
+            conn.executemany("INSERT INTO students (id, first_name, last_name, age, grade, enrollement_date, data_entry_date) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             student_rows)
+            conn.executemany("INSERT INTO student_lessons (student_id, lesson_id) VALUES (?, ?)", lesson_rows)
+        stats["imported"] += len(student_rows)
+        stats["enrollments"] += len(lesson_rows)
+        batch.clear()
+
+    started = time.perf_counter()
+    try:
+        for line_no, record in read_import_file(path):
+            stats["read"] += 1
+            try:
+                student, lessons = validate_student_record(record)
+            except ValueError as e:
+                reject(line_no, str(e), record)
+                continue
+            if student[0] in seen_ids:
+                reject(line_no, "Duplicate student ID in import file.", record)
+                continue
+            unknown_lessons = [lesson_id for lesson_id in lessons if lesson_id not in lesson_ids]
+            if unknown_lessons:
+                reject(line_no, f"Unknown lesson ID(s): {', '.join(map(str, unknown_lessons))}.", record)
+                continue
+            seen_ids.add(student[0])
+            batch.append((line_no, record, student, lessons))
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    finally:
+        if reject_file is not None:
+            reject_file.close()
+
+    stats["seconds"] = time.perf_counter() - started
+    stats["reject_path"] = reject_path if stats["rejected"] else None
+    return stats
+
+## Bulk import entry point used by the 'import' command
+def run_bulk_import(path, batch_size, reject_path):
+    try:
+        stats = import_students(get_connection(), path, batch_size, reject_path)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Import failed: {e}")
+        return False
+    rate = stats["read"] / stats["seconds"] if stats["seconds"] else 0
+    print(f"Imported {stats['imported']} students and {stats['enrollments']} lesson enrollments "
+          f"from {stats['read']} rows in {stats['seconds']:.2f}s ({rate:.0f} rows/sec).")
+    if stats["rejected"]:
+        print(f"Rejected {stats['rejected']} rows, see {stats['reject_path']} for the reasons.")
+    return True
+
+############################################## Reports ##############################################
+# Every report has a live query that aggregates students / student_lessons and a materialized
+# query that reads the trigger-maintained summary tables, which only hold one row per grade,
+# month or lesson. Both return the same columns.
+REPORTS = {
+    "grades": {
+        "description": "Number of students per grade",
+        "columns": ["grade", "students", "percent"],
+        "live": """
+            SELECT grade, COUNT(*) AS students,
+                   ROUND(100.0 * COUNT(*) / SUM(COUNT(*)) OVER (), 2) AS percent
+            FROM students
+            GROUP BY grade
+            ORDER BY grade""",
+        "materialized": """
+            SELECT grade, students,
+                   ROUND(100.0 * students / SUM(students) OVER (), 2) AS percent
+            FROM report_grade_counts
+            ORDER BY grade""",
+    },
+    "lessons": {
+        "description": "Number of students enrolled in each lesson",
+        "columns": ["lesson_id", "lesson", "enrollments", "rank"],
+        "live": """
+            SELECT lessons.id, lessons.name, COUNT(student_lessons.student_id) AS enrollments,
+                   RANK() OVER (ORDER BY COUNT(student_lessons.student_id) DESC) AS rank
+            FROM lessons
+            LEFT JOIN student_lessons ON student_lessons.lesson_id = lessons.id
+            GROUP BY lessons.id
+            ORDER BY lessons.id""",
+        "materialized": """
+            SELECT lessons.id, lessons.name, COALESCE(report_lesson_counts.enrollments, 0) AS enrollments,
+                   RANK() OVER (ORDER BY COALESCE(report_lesson_counts.enrollments, 0) DESC) AS rank
+            FROM lessons
+            LEFT JOIN report_lesson_counts ON report_lesson_counts.lesson_id = lessons.id
+            ORDER BY lessons.id""",
+    },
+    "months": {
+        "description": "Number of students enrolled per month, with a running total",
+        "columns": ["month", "students", "running_total"],
+        "live": f"""
+            SELECT {report_month("enrollement_date")} AS month, COUNT(*) AS students,
+                   SUM(COUNT(*)) OVER (ORDER BY {report_month("enrollement_date")}) AS running_total
+            FROM students
+            GROUP BY month
+            ORDER BY month""",
+        "materialized": """
+            SELECT month, students, SUM(students) OVER (ORDER BY month) AS running_total
+            FROM report_month_counts
+            ORDER BY month""",
+    },
+}
+
+# Recompute the summary tables from scratch (after the migration that adds them, or to repair drift)
+def rebuild_report_tables(conn, month=report_month):
+    with transaction(conn):
+        conn.execute("DELETE FROM report_grade_counts")
+        conn.execute("INSERT INTO report_grade_counts (grade, students) SELECT grade, COUNT(*) FROM students GROUP BY grade")
+        conn.execute("DELETE FROM report_month_counts")
+        conn.execute(f"""
+            INSERT INTO report_month_counts (month, students)
+            SELECT {month("enrollement_date")}, COUNT(*) FROM students GROUP BY 1""")
+        conn.execute("DELETE FROM report_lesson_counts")
+        conn.execute("INSERT INTO report_lesson_counts (lesson_id, enrollments) SELECT lesson_id, COUNT(*) FROM student_lessons GROUP BY lesson_id")
+
+# Return a cursor over the rows of a report; iterate it to stream the rows
+def run_report(conn, name, live=False):
+    if name not in REPORTS:
+        raise ValueError(f"Unknown report '{name}'. Choose one of: {', '.join(REPORTS)}.")
+    return conn.execute(REPORTS[name]["live" if live else "materialized"])
+
+# Write a report to file as CSV or as a JSON array of objects, one row at a time
+def export_report(conn, name, file, format="csv", live=False):
+    rows = run_report(conn, name, live)
+    columns = REPORTS[name]["columns"]
+    count = 0
+    if format == "csv":
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    elif format == "json":
+        file.write("[")
+        for row in rows:
+            file.write(("," if count else "") + "\n  " + json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+            count += 1
+        file.write("\n]\n")
+    else:
+        raise ValueError(f"Unknown export format '{format}'. Choose csv or json.")
+    return count
+
+## Report export used by the 'report' command
+def show_report(name, format, output, live):
+    conn = get_connection()
+    try:
+        if output is None:
+            export_report(conn, name, sys.stdout, format, live)
+            return True
+        with open(output, 'w', newline='', encoding='utf-8') as file:
+            count = export_report(conn, name, file, format, live)
+    except (ValueError, sqlite3.Error, OSError) as e:
+        print(f"Report failed: {e}")
+        return False
+    print(f"Wrote {count} rows of the '{name}' report to {output}.")
+    return True
+
+############################################## Maintenance ##############################################
+# Count enrollments that point at a student or lesson that no longer exists
+# (left behind by versions of the program that ran without foreign key enforcement)
+def count_orphaned_enrollments(conn):
+    return conn.execute("""
+        SELECT COUNT(*) FROM student_lessons
+        WHERE student_id NOT IN (SELECT id FROM students) OR lesson_id NOT IN (SELECT id FROM lessons)
+        """).fetchone()[0]
+
+def remove_orphaned_enrollments(conn):
+    with transaction(conn):
+        return conn.execute("""
+            DELETE FROM student_lessons
+            WHERE student_id NOT IN (SELECT id FROM students) OR lesson_id NOT IN (SELECT id FROM lessons)
+            """).rowcount
+
+# Remove orphaned enrollments, recompute the report summaries, refresh the query planner statistics and give free pages back
+# to the file system. The first run switches the database to incremental auto-vacuum, which
+# needs one full VACUUM; later runs only use the cheap PRAGMA incremental_vacuum.
+def run_maintenance(conn):
+    report = {"orphans_removed": remove_orphaned_enrollments(conn)}
+    rebuild_report_tables(conn)
+    conn.execute("ANALYZE")
+    conn.commit()
+    report["free_pages_before"] = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:  # 2 = INCREMENTAL
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        # executescript() steps the pragma to completion; execute() would free a single page
+        conn.executescript("PRAGMA incremental_vacuum")
+    report["free_pages_after"] = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return report
+
+# The hot queries of the program and the index each of them is expected to use
+HOT_QUERIES = [
+    ("Lesson name uniqueness check (add_lesson)",
+     "SELECT name FROM lessons WHERE name = ?", ("Math",)),
+    ("Student profile with enrolled lessons (display_student)",
+     STUDENT_PROFILE_QUERY, (1,)),
+    ("Students enrolled in a lesson",
+     "SELECT student_id FROM student_lessons WHERE lesson_id = ?", (1,)),
+    ("Student search by last name",
+     "SELECT id, first_name, last_name FROM students WHERE last_name = ? ORDER BY first_name", ("Itair",)),
+    ("Students enrolled in a date range (delete-students)",
+     "SELECT id FROM students WHERE enrollement_date BETWEEN ? AND ?", (date_to_day("2024-01-01"), date_to_day("2024-12-31"))),
+]
+
+# Run EXPLAIN QUERY PLAN for every hot query. A query passes when none of its steps is a full table scan.
+def check_query_plans(conn=None):
+    if conn is None:
+        conn = get_connection()
+    results = []
+    for description, query, params in HOT_QUERIES:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+        uses_index = all(not step.startswith("SCAN") for step in plan)
+        results.append((description, plan, uses_index))
+    return results
+
+## Query plan report used by the 'check-indexes' command
+def show_query_plans():
+    results = check_query_plans()
+    for description, plan, uses_index in results:
+        print(f"[{'OK' if uses_index else 'FULL SCAN'}] {description}")
+        for step in plan:
+            print(f"    {step}")
+    return all(uses_index for _, _, uses_index in results)
+
+## Query statistics shown by the 'qs' menu option
+def show_query_stats(limit=20):
+    if query_stats is None:
+        print("Query statistics are off. Start the program with --query-stats to collect them.")
+        return
+    summary = query_stats.summary()
+    if not summary["statements"]:
+        print("No queries have run yet.")
+        return
+    print(f"{'calls':>7} {'total ms':>10} {'avg ms':>8} {'max ms':>8} {'rows':>8}  statement")
+    for statement in summary["statements"][:limit]:
+        sql = statement["sql"] if len(statement["sql"]) <= 70 else statement["sql"][:67] + "..."
+        print(f"{statement['calls']:>7} {statement['total_ms']:>10.2f} {statement['avg_ms']:>8.3f} "
+              f"{statement['max_ms']:>8.3f} {statement['rows']:>8}  {sql}")
+    print(f"\n{len(summary['slow_queries'])} slow queries (>= {summary['slow_ms']:g} ms):")
+    for entry in summary["slow_queries"][-5:]:
+        print(f"  {entry['ms']:.1f} ms  {entry['sql'][:70]}")
+        for step in entry["plan"] or []:
+            print(f"      {step}")
+
+## Maintenance report used by the 'maintenance' command
+def show_maintenance():
+    conn = get_connection()
+    try:
+        print(f"Found {count_orphaned_enrollments(conn)} orphaned enrollments.")
+        report = run_maintenance(conn)
+    except sqlite3.Error as e:
+        print(f"Maintenance failed: {e}")
+        return False
+    print(f"Removed {report['orphans_removed']} orphaned enrollments.")
+    print(f"Free pages: {report['free_pages_before']} before, {report['free_pages_after']} after vacuum.")
+    return True
+
+## Bulk delete used by the 'delete-students' command
+def run_bulk_delete(ids, grade, enrolled_from, enrolled_to, confirmed):
+    if not confirmed:
+        confirmation = input("Are you sure you want to delete all matching students and their related lessons? (yes/no): ").strip().lower()
+        if confirmation != 'yes':
+            print("Student deletion cancelled.")
+            return False
+    try:
+        deleted = delete_students(get_connection(), ids, grade, enrolled_from, enrolled_to)
+    except ValueError as e:
+        print(e)
+        return False
+    print(f"Deleted {deleted} students and their related lessons.")
+    return True
+
+############################################## Backup and Restore ##############################################
+# Online backups with SQLite's backup API instead of copying the file, which can tear during a commit.
+# In WAL mode (the 'fast' and 'bulk' profiles) the copy is made from a read transaction, i.e. a
+# consistent snapshot of the moment the backup started, and writers keep committing while it runs.
+# In rollback-journal mode ('safe') writers are locked out while the copy reads the database, and
+# a commit between two steps would make SQLite start the copy again, so the whole database is
+# copied in one step as fast as possible; throttling would only make writers wait longer.
+DEFAULT_BACKUP_PAGES = 256      # pages copied per step (-1 copies everything in one step)
+BACKUP_COMPRESS_LEVEL = 6       # gzip level: most of the size reduction of level 9 in a fraction of the time
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Copy the database of conn to destination, `pages` pages per step with a pause of `sleep`
+# seconds between steps (in WAL mode, see above). With compress=True the file is gzip-compressed. The backup is written
+# next to destination and renamed into place when complete, so there is never a half-written
+# backup at that path. Returns a dict with the pages copied, the output size and the time taken.
+def backup_database(conn, destination, pages=DEFAULT_BACKUP_PAGES, sleep=0, compress=False):
+    if conn.in_transaction:
+        raise ValueError("Finish the current transaction before taking a backup.")
+    wal = conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    if sleep and not wal:
+        raise ValueError("Throttling a backup with a pause between steps needs WAL mode (the 'fast' or 'bulk' profile).")
+    snapshot_path = destination + ".snapshot"
+    partial_path = destination + ".partial"
+    for path in (snapshot_path, partial_path):
+        if os.path.exists(path):
+            os.remove(path)
+    copied = {"pages": 0}
+
+    def progress(status, remaining, total):
+        copied["pages"] = total
+        if sleep and remaining:
+            time.sleep(sleep)
+
+    started = time.perf_counter()
+    try:
+        target = sqlite3.connect(snapshot_path)
+        try:
+            if wal:
+                # Pin the snapshot so that commits by other connections do not restart the copy
+                conn.execute("BEGIN")
+                try:
+                    conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                    conn.backup(target, pages=pages, progress=progress)
+                finally:
+                    conn.rollback()
+            else:
+                conn.backup(target, pages=-1, progress=progress)
+            # The copy has the journal mode of the live database; a WAL backup would get -wal and
+            # -shm files next to it as soon as it is opened, even read-only by restore_database
+            target.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            target.close()
+        if compress:
+            with open(snapshot_path, 'rb') as source, gzip.open(partial_path, 'wb', compresslevel=BACKUP_COMPRESS_LEVEL) as output:
+                shutil.copyfileobj(source, output)
+            os.replace(partial_path, destination)
+        else:
+            os.replace(snapshot_path, destination)
+    finally:
+        for path in (snapshot_path, partial_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return {"pages": copied["pages"], "bytes": os.path.getsize(destination), "seconds": time.perf_counter() - started}
+
+# Rows of PRAGMA integrity_check that report a problem (empty when the database is fine)
+def integrity_problems(conn):
+    problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    return [] if problems == ["ok"] else problems
+
+# Replace the database of conn with the backup at source (plain or gzip-compressed).
+# The backup is checked with PRAGMA integrity_check before anything is overwritten and the
+# restored database is checked again afterwards; problems are reported with ValueError.
+# The copy is one transaction, so a failed restore leaves the database as it was.
+def restore_database(conn, source, pages=DEFAULT_BACKUP_PAGES):
+    if conn.in_transaction:
+        raise ValueError("Finish the current transaction before restoring a backup.")
+    if not os.path.isfile(source):
+        raise ValueError(f"Backup file '{source}' does not exist.")
+    change_log_before = change_log_position(conn)
+    with open(source, 'rb') as file:
+        compressed = file.read(2) == GZIP_MAGIC
+
+    started = time.perf_counter()
+    snapshot_path = None
+    try:
+        if compressed:
+            fd, snapshot_path = tempfile.mkstemp(suffix=".db")
+            with os.fdopen(fd, 'wb') as output, gzip.open(source, 'rb') as backup_file:
+                shutil.copyfileobj(backup_file, output)
+        backup = sqlite3.connect(f"file:{snapshot_path or source}?mode=ro", uri=True)
+        try:
+            try:
+                problems = integrity_problems(backup)
+            except sqlite3.DatabaseError as e:
+                raise ValueError(f"'{source}' is not a valid database backup: {e}")
+            if problems:
+                raise ValueError(f"The backup failed its integrity check: {problems[0]}")
+            backup.backup(conn, pages=pages)
+        finally:
+            backup.close()
+    finally:
+        if snapshot_path is not None:
+            os.remove(snapshot_path)
+
+    problems = integrity_problems(conn)
+    if problems:
+        raise ValueError(f"The restored database failed its integrity check: {problems[0]}")
+    # Backups made by older versions of the program get the newer schema changes
+    version = migrate_database(conn)
+    mark_restore_in_change_log(conn, change_log_before, source)
+    profile_cache.clear()
+    invalidate_lesson_catalog(conn)
+    return {"seconds": time.perf_counter() - started, "schema_version": version}
+
+## Backup used by the 'backup' command
+def run_backup(destination, pages, sleep, compress):
+    try:
+        result = backup_database(get_connection(), destination, pages, sleep, compress)
+    except (ValueError, sqlite3.Error, OSError) as e:
+        print(f"Backup failed: {e}")
+        return False
+    print(f"Backed up {result['pages']} pages to {destination} ({result['bytes']:,} bytes) in {result['seconds']:.2f}s.")
+    return True
+
+## Restore used by the 'restore' command
+def run_restore(source, pages, confirmed):
+    if not confirmed:
+        confirmation = input(f"This replaces all data in {database_path} with {source}. Continue? (yes/no): ").strip().lower()
+        if confirmation != 'yes':
+            print("Restore cancelled.")
+            return False
+    try:
+        result = restore_database(get_connection(), source, pages)
+    except (ValueError, sqlite3.Error, OSError) as e:
+        print(f"Restore failed: {e}")
+        return False
+    print(f"Restored {source} in {result['seconds']:.2f}s; integrity check passed.")
+    return True
+
+############################################## Change Log ##############################################
+# Incremental export of change_log (see migration 6). Exporting the changes after a seq is a range
+# scan of the change_log primary key, so a sync costs time in proportion to the number of changes.
+
+# Stream the changes with seq > after_seq to file as JSON lines, oldest first. With a consumer
+# name, the export starts after that consumer's last position (unless after_seq is given) and the
+# position is moved to the last change written once all of them are written.
+# Returns {"changes": number written, "last_seq": seq of the last change written (or after_seq)}.
+def export_changes(conn, file, after_seq=None, consumer=None, limit=None):
+    if after_seq is None:
+        after_seq = 0
+        if consumer is not None:
+            row = conn.execute("SELECT last_seq FROM change_log_consumers WHERE name = ?", (consumer,)).fetchone()
+            after_seq = row[0] if row else 0
+    rows = conn.execute("""
+        SELECT seq, json_object('seq', seq, 'changed_at', datetime(changed_at, 'unixepoch'), 'table', table_name,
+                                'operation', operation, 'before', json(before), 'after', json(after))
+        FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?""", (after_seq, -1 if limit is None else limit))
+    count = 0
+    last_seq = after_seq
+    for last_seq, change in rows:
+        file.write(change + "\n")
+        count += 1
+    if consumer is not None:
+        with transaction(conn):
+            conn.execute("""
+                INSERT INTO change_log_consumers (name, last_seq) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET last_seq = excluded.last_seq""", (consumer, last_seq))
+    return {"changes": count, "last_seq": last_seq}
+
+# Delete the changes up to and including through_seq. Without through_seq, the changes every
+# registered consumer has already exported are deleted. Returns the number of changes deleted.
+def prune_changes(conn, through_seq=None):
+    if through_seq is None:
+        through_seq = conn.execute("SELECT MIN(last_seq) FROM change_log_consumers").fetchone()[0]
+        if through_seq is None:
+            raise ValueError("No consumer has exported any changes yet; give the last seq to prune.")
+    with transaction(conn):
+        return conn.execute("DELETE FROM change_log WHERE seq <= ?", (through_seq,)).rowcount
+
+# Forget a consumer so its position no longer holds back pruning
+def remove_change_consumer(conn, consumer):
+    with transaction(conn):
+        return conn.execute("DELETE FROM change_log_consumers WHERE name = ?", (consumer,)).rowcount > 0
+
+# The last seq handed out and the position of every consumer, or None when the database has no change log yet
+def change_log_position(conn):
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'change_log'").fetchone() is None:
+        return None
+    last_seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return {"last_seq": last_seq[0] if last_seq else 0,
+            "consumers": dict(conn.execute("SELECT name, last_seq FROM change_log_consumers"))}
+
+# After a restore, the change log and the consumer positions are the backup's. Continue seq after
+# the highest seq used before the restore (so no seq is ever handed out twice), keep consumers
+# from moving back to changes they already exported, and append a 'restore' entry: the rows a
+# consumer exported since the backup was taken may have been reverted, so it has to resync.
+def mark_restore_in_change_log(conn, before, source):
+    if before is None:
+        return
+    with transaction(conn):
+        restored = change_log_position(conn)
+        conn.execute("INSERT INTO change_log (seq, table_name, operation, after) VALUES (?, '*', 'restore', json_object('backup', ?))",
+                     (max(before["last_seq"], restored["last_seq"]) + 1, os.path.abspath(source)))
+        conn.executemany("""
+            INSERT INTO change_log_consumers (name, last_seq) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET last_seq = max(last_seq, excluded.last_seq)""", before["consumers"].items())
+
+## Change export used by the 'changes' command
+def run_change_export(after_seq, consumer, output, limit):
+    conn = get_connection()
+    try:
+        if output is None:
+            result = export_changes(conn, sys.stdout, after_seq, consumer, limit)
+        else:
+            with open(output, 'w', encoding='utf-8') as file:
+                result = export_changes(conn, file, after_seq, consumer, limit)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Export failed: {e}", file=sys.stderr)
+        return False
+    print(f"Exported {result['changes']} changes (last seq {result['last_seq']}).", file=sys.stderr)
+    return True
+
+## Pruning used by the 'prune-changes' command
+def run_change_prune(through_seq, remove_consumer):
+    conn = get_connection()
+    if remove_consumer is not None and not remove_change_consumer(conn, remove_consumer):
+        print(f"Consumer '{remove_consumer}' not found.")
+        return False
+    try:
+        deleted = prune_changes(conn, through_seq)
+    except ValueError as e:
+        print(e)
+        return False
+    print(f"Deleted {deleted} changes.")
+    return True
+
+############################################## Federated Queries ##############################################
+# Read operations over many school databases (one file per school) at once. Every file is queried
+# in a worker process of its own, opened read-only, and the results are streamed back as each
+# file finishes, every row tagged with the file it came from.
+
+# Open a database file read-only: it is never created, migrated or written to
+def connect_read_only(path):
+    return sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+
+# The operations, each (conn, argument) -> list of row dicts
+def federated_count(conn, argument):
+    return [{"students": conn.execute("SELECT COUNT(*) FROM students").fetchone()[0]}]
+
+def federated_list(conn, argument):
+    return [{"id": id, "first_name": first_name, "last_name": last_name}
+            for id, first_name, last_name in conn.execute("SELECT id, first_name, last_name FROM students ORDER BY id")]
+
+def federated_find(conn, student_id):
+    row = conn.execute(STUDENT_PROFILE_QUERY, (student_id,)).fetchone()
+    if row is None:
+        return []
+    profile = student_profile_from_row(row)._asdict()
+    profile["enrollement_date"] = day_to_date(profile["enrollement_date"])
+    profile["data_entry_date"] = day_to_date(profile["data_entry_date"])
+    return [profile]
+
+def federated_enrollments(conn, argument):
+    return [dict(zip(REPORTS["lessons"]["columns"], row)) for row in run_report(conn, "lessons")]
+
+FEDERATED_OPERATIONS = {
+    "count": federated_count,
+    "list": federated_list,
+    "find": federated_find,
+    "enrollments": federated_enrollments,
+}
+
+# Run one operation on one file (in a worker process). Returns (path, rows, error message).
+def run_federated_operation(path, operation, argument=None):
+    try:
+        conn = connect_read_only(path)
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != len(MIGRATIONS):
+                raise ValueError(f"schema version {version} instead of {len(MIGRATIONS)}; open it with this program once to upgrade it")
+            rows = FEDERATED_OPERATIONS[operation](conn, argument)
+        finally:
+            conn.close()
+    except (ValueError, sqlite3.Error) as e:
+        return path, None, str(e)
+    return path, rows, None
+
+# Run an operation on every file with up to `workers` processes (default: one per CPU core) and
+# yield {"source": path, ...row} dicts as the files finish. A file that cannot be queried yields
+# one {"source": path, "error": message} dict instead.
+def federated_query(paths, operation, argument=None, workers=None):
+    if operation not in FEDERATED_OPERATIONS:
+        raise ValueError(f"Unknown operation '{operation}'. Choose one of: {', '.join(FEDERATED_OPERATIONS)}.")
+    paths = list(dict.fromkeys(paths))
+    if not paths:
+        return
+    executor = ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(paths)))
+    try:
+        futures = [executor.submit(run_federated_operation, path, operation, argument) for path in paths]
+        for future in as_completed(futures):
+            path, rows, error = future.result()
+            if error is not None:
+                yield {"source": path, "error": error}
+                continue
+            for row in rows:
+                yield {"source": path, **row}
+    finally:
+        # Stopping early cancels the files that have not started yet
+        executor.shutdown(cancel_futures=True)
+
+## Federated query used by the 'federated' command: JSON lines on stdout, a summary on stderr
+def run_federated(operation, paths, student_id, workers):
+    if operation == "find" and student_id is None:
+        print("The find operation needs --id.", file=sys.stderr)
+        return False
+    started = time.perf_counter()
+    rows = 0
+    errors = 0
+    students = 0
+    for row in federated_query(paths, operation, student_id, workers):
+        if "error" in row:
+            errors += 1
+            print(f"{row['source']}: {row['error']}", file=sys.stderr)
+            continue
+        rows += 1
+        students += row.get("students", 0) if operation == "count" else 0
+        print(json.dumps(row))
+    summary = f"{len(set(paths))} databases, {rows} rows, {errors} errors in {time.perf_counter() - started:.2f}s"
+    if operation == "count":
+        summary += f"; {students} students in total"
+    print(summary + ".", file=sys.stderr)
+    return errors == 0
+
+############################################## Scriptable Commands ##############################################
+# The menu operations as command line subcommands that take flags instead of prompts, e.g.
+#   python full_code.py as --id 7 --first-name Sara --last-name Haddad --age 12 --grade 7 --enrollement-date 2024-09-01 --lessons 1 2
+# The same commands, one per line, can be run from a file or stdin with the 'batch' command.
+OPERATION_COMMANDS = ("as", "ss", "vs", "ms", "ds", "al", "vl", "ml", "als", "dl")
+
+# Argument parser that raises ValueError instead of exiting, used for the lines of a batch script
+class BatchArgumentParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise ValueError(message)
+
+    # -h on a batch line would otherwise print the help and end the whole program
+    def print_help(self, file=None):
+        raise ValueError("-h/--help cannot be used in a batch.")
+
+    def exit(self, status=0, message=None):
+        raise ValueError(message.strip() if message else f"'{self.prog}' cannot be used in a batch.")
+
+def add_operation_commands(subparsers):
+    add_parser = subparsers.add_parser("as", help="add a student")
+    add_parser.add_argument("--id", required=True, help="student ID")
+    add_parser.add_argument("--first-name", required=True)
+    add_parser.add_argument("--last-name", required=True)
+    add_parser.add_argument("--age", required=True, help="5 to 19")
+    add_parser.add_argument("--grade", required=True, help="1 to 12")
+    add_parser.add_argument("--enrollement-date", required=True, help="YYYY-MM-DD")
+    add_parser.add_argument("--lessons", type=int, nargs="*", default=[], help="IDs of the lessons to enroll the student in")
+
+    list_parser = subparsers.add_parser("ss", help="list students ordered by ID")
+    list_parser.add_argument("--after-id", type=int, default=None, help="only list students with a greater ID")
+    list_parser.add_argument("--limit", type=positive_int, default=None, help="maximum number of students to list")
+
+    view_parser = subparsers.add_parser("vs", help="view student information")
+    view_parser.add_argument("student_id", type=int)
+
+    modify_parser = subparsers.add_parser("ms", help="modify student information (only the given fields change)")
+    modify_parser.add_argument("student_id", type=int)
+    modify_parser.add_argument("--first-name")
+    modify_parser.add_argument("--last-name")
+    modify_parser.add_argument("--age")
+    modify_parser.add_argument("--grade")
+    modify_parser.add_argument("--enrollement-date")
+
+    delete_parser = subparsers.add_parser("ds", help="delete a student and their enrollments")
+    delete_parser.add_argument("student_id", type=int)
+
+    add_lesson_parser = subparsers.add_parser("al", help="add a lesson")
+    add_lesson_parser.add_argument("name")
+
+    subparsers.add_parser("vl", help="view the lessons list")
+
+    modify_lesson_parser = subparsers.add_parser("ml", help="rename a lesson")
+    modify_lesson_parser.add_argument("lesson_id", type=int)
+    modify_lesson_parser.add_argument("name")
+
+    assign_parser = subparsers.add_parser("als", help="assign lessons to a student")
+    assign_parser.add_argument("student_id", type=int)
+    assign_parser.add_argument("lesson_ids", type=int, nargs="+")
+
+    delete_lesson_parser = subparsers.add_parser("dl", help="delete a lesson and its enrollments")
+    delete_lesson_parser.add_argument("lesson_id", type=int)
+
+# Run one operation command on conn. Invalid input raises ValueError with the same messages
+# as the interactive prompts.
+def run_operation(conn, args):
+    if args.command == "as":
+        insert_student(conn, {"id": args.id, "first_name": args.first_name, "last_name": args.last_name,
+                              "age": args.age, "grade": args.grade, "enrollement_date": args.enrollement_date,
+                              "lessons": args.lessons})
+        print("Student added successfully!")
+    elif args.command == "ss":
+        students = fetch_students_page(conn, args.after_id, args.limit) if args.limit else iter_students(conn, args.after_id)
+        for student in students:
+            print(f"ID: {student[0]}, First Name: {student[1]}, Last Name: {student[2]}")
+    elif args.command == "vs":
+        student_info = get_student_profile(conn, args.student_id)
+        if student_info is None:
+            raise ValueError("Student not found!")
+        print_student_profile(student_info)
+    elif args.command == "ms":
+        changes = {field: getattr(args, field) for field in STUDENT_FIELD_VALIDATORS if getattr(args, field) is not None}
+        if update_student(conn, args.student_id, changes) is None:
+            raise ValueError("Student not found!")
+        print("Student information modified successfully!")
+    elif args.command == "ds":
+        if not remove_student(conn, args.student_id):
+            raise ValueError("No student found with the provided ID.")
+        print("Student and his/her related lessons deleted successfully!!")
+    elif args.command == "al":
+        insert_lesson(conn, args.name)
+        print("Lesson added successfully.")
+    elif args.command == "vl":
+        for lesson in fetch_lessons(conn):
+            print(f"ID: {lesson[0]}, Name: {lesson[1]}")
+    elif args.command == "ml":
+        if not rename_lesson(conn, args.lesson_id, args.name):
+            raise ValueError("This lesson does not exist.")
+        print("Lesson modified successfully.")
+    elif args.command == "als":
+        if not student_exists(conn, args.student_id):
+            raise ValueError("Student not found!")
+        known_lessons = get_lesson_catalog(conn).names_by_id
+        unknown_lessons = [lesson_id for lesson_id in args.lesson_ids if lesson_id not in known_lessons]
+        if unknown_lessons:
+            raise ValueError(f"Invalid lesson ID(s): {', '.join(map(str, unknown_lessons))}.")
+        result = enroll_student(conn, args.student_id, args.lesson_ids)
+        if result["skipped"]:
+            print(f"Student was already enrolled in {result['skipped']} of the lessons.")
+        print("Lessons assigned successfully.")
+    elif args.command == "dl":
+        if not remove_lesson(conn, args.lesson_id):
+            raise ValueError("This lesson does not exist.")
+        print("Lesson deleted successfully.")
+
+# Run the operation commands of a batch script (one per line, '#' starts a comment) over one
+# connection in one transaction. The first failing line rolls the whole batch back.
+# Returns True when every command succeeded.
+def run_batch(file):
+    parser = BatchArgumentParser(prog="batch", add_help=False)
+    add_operation_commands(parser.add_subparsers(dest="command", required=True))
+
+    conn = get_connection()
+    conn.execute("BEGIN")
+    try:
+        count = 0
+        for line_no, line in enumerate(file, start=1):
+            try:
+                words = shlex.split(line, comments=True)
+                if not words:
+                    continue
+                run_operation(conn, parser.parse_args(words))
+            except (ValueError, sqlite3.Error) as e:
+                raise ValueError(f"Line {line_no}: {e}")
+            count += 1
+        conn.commit()
+    except ValueError as e:
+        conn.rollback()
+        print(e)
+        print("Batch cancelled, no changes were made.")
+        return False
+    finally:
+        # Profiles and lessons read during the batch may describe changes that were rolled back
+        profile_cache.clear()
+        invalidate_lesson_catalog(conn)
+    print(f"Batch completed: {count} commands.")
+    return True
+
 ################################################## MAIN MENU ##################################################
+# argparse type for options that must be a positive integer
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be a positive integer")
+    return number
+
+# Command line arguments; without a command the interactive menu is started
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="School Database CLI Program")
+    parser.add_argument("--db", default=DATABASE_PATH, help=f"path of the SQLite database file (default: {DATABASE_PATH})")
+    parser.add_argument("--profile", choices=CONNECTION_PROFILES, default=DEFAULT_PROFILE, help=f"connection tuning profile (default: {DEFAULT_PROFILE})")
+    parser.add_argument("--page-size", type=positive_int, default=DEFAULT_PAGE_SIZE, help=f"number of students shown per page when listing students (default: {DEFAULT_PAGE_SIZE})")
+    parser.add_argument("--query-stats", action="store_true", help="time every SQL statement (see the 'qs' menu option)")
+    parser.add_argument("--slow-ms", type=float, default=DEFAULT_SLOW_QUERY_MS, help=f"with --query-stats: log statements that take at least this long (default: {DEFAULT_SLOW_QUERY_MS})")
+    parser.add_argument("--slow-log", default=None, help="with --query-stats: append slow statements and their query plans to this JSONL file")
+    parser.add_argument("--stats-json", default=None, help="collect query statistics and write them to this JSON file on exit")
+    subparsers = parser.add_subparsers(dest="command")
+
+    import_parser = subparsers.add_parser("import", help="bulk import students from a CSV or JSONL file")
+    import_parser.add_argument("file", help="CSV (with header) or JSONL file with id, first_name, last_name, age, grade, enrollement_date and optional lessons")
+    import_parser.add_argument("--batch-size", type=positive_int, default=1000, help="number of rows written per transaction (default: 1000)")
+    import_parser.add_argument("--reject-file", default=None, help="where to write rejected rows (default: <file>.rejects.csv)")
+
+    delete_parser = subparsers.add_parser("delete-students", help="delete all students matching the given IDs, grade and/or enrollment date range")
+    delete_parser.add_argument("--ids", type=int, nargs="+", default=None, help="student IDs to delete")
+    delete_parser.add_argument("--grade", type=int, default=None, help="only delete students in this grade")
+    delete_parser.add_argument("--enrolled-from", default=None, help="only delete students enrolled on or after this date (YYYY-MM-DD)")
+    delete_parser.add_argument("--enrolled-to", default=None, help="only delete students enrolled on or before this date (YYYY-MM-DD)")
+    delete_parser.add_argument("--yes", action="store_true", help="do not ask for confirmation")
+
+    search_parser = subparsers.add_parser("search", help="search students and lessons by (part of) their name")
+    search_parser.add_argument("text", help="words to search for; each word matches the start of a name, or a similar name when none does")
+    search_parser.add_argument("--limit", type=positive_int, default=DEFAULT_SEARCH_LIMIT, help=f"maximum number of results of each kind (default: {DEFAULT_SEARCH_LIMIT})")
+
+    report_parser = subparsers.add_parser("report", help="export an aggregate report as CSV or JSON")
+    report_parser.add_argument("name", choices=REPORTS, help="; ".join(f"{name}: {report['description']}" for name, report in REPORTS.items()))
+    report_parser.add_argument("--format", choices=("csv", "json"), default="csv", help="output format (default: csv)")
+    report_parser.add_argument("--output", default=None, help="file to write to (default: stdout)")
+    report_parser.add_argument("--live", action="store_true", help="aggregate the student tables instead of reading the summary tables")
+
+    subparsers.add_parser("maintenance", help="remove orphaned enrollments, rebuild report summaries, then run ANALYZE and incremental VACUUM")
+
+    subparsers.add_parser("check-indexes", help="show the query plan of the hot queries and check that each uses an index")
+
+    backup_parser = subparsers.add_parser("backup", help="copy a consistent snapshot of the live database to a file")
+    backup_parser.add_argument("file", help="backup file to write")
+    backup_parser.add_argument("--pages", type=int, default=DEFAULT_BACKUP_PAGES, help=f"pages copied per step in WAL mode, -1 for all at once (default: {DEFAULT_BACKUP_PAGES})")
+    backup_parser.add_argument("--sleep", type=float, default=0, help="seconds to pause between steps to throttle the copy, WAL mode only (default: 0)")
+    backup_parser.add_argument("--compress", action="store_true", help="gzip-compress the backup")
+
+    restore_parser = subparsers.add_parser("restore", help="replace the database with a (plain or compressed) backup after checking its integrity")
+    restore_parser.add_argument("file", help="backup file to restore")
+    restore_parser.add_argument("--pages", type=int, default=DEFAULT_BACKUP_PAGES, help=f"pages copied per step (default: {DEFAULT_BACKUP_PAGES})")
+    restore_parser.add_argument("--yes", action="store_true", help="do not ask for confirmation")
+
+    changes_parser = subparsers.add_parser("changes", help="export the logged changes to students, lessons and enrollments as JSON lines")
+    changes_parser.add_argument("--after", type=int, default=None, help="only changes with a seq greater than this (default: the consumer's last position, or all)")
+    changes_parser.add_argument("--consumer", default=None, help="name of the downstream system; its position is remembered between exports")
+    changes_parser.add_argument("--output", default=None, help="file to write to (default: stdout)")
+    changes_parser.add_argument("--limit", type=positive_int, default=None, help="maximum number of changes to export")
+
+    prune_parser = subparsers.add_parser("prune-changes", help="delete logged changes that every consumer has exported")
+    prune_parser.add_argument("--through", type=int, default=None, help="delete the changes up to this seq instead")
+    prune_parser.add_argument("--remove-consumer", default=None, help="forget this consumer first")
+
+    federated_parser = subparsers.add_parser("federated", help="run a read operation over many school databases in parallel (ignores --db)")
+    federated_parser.add_argument("operation", choices=FEDERATED_OPERATIONS, help="count: students per school; list: all students; find: the student with --id; enrollments: students per lesson")
+    federated_parser.add_argument("databases", nargs="+", help="database files to query (opened read-only)")
+    federated_parser.add_argument("--id", type=int, default=None, help="student ID for the find operation")
+    federated_parser.add_argument("--workers", type=positive_int, default=None, help="worker processes (default: one per CPU core)")
+
+    add_operation_commands(subparsers)
+
+    batch_parser = subparsers.add_parser("batch", help="run many commands (one per line) in one transaction")
+    batch_parser.add_argument("file", nargs="?", default="-", help="file with the commands, '-' for stdin (default)")
+
+    return parser.parse_args(argv)
+
+def print_menu():
+    print("\n ***** Welcome to School Database CLI Program *****")
+    print("Please choose the operation you want to perform:")
+    print("=== Student-related operation ===")
+    print("To add a student, press 'as'")
+    print("To show the list of all students, press 'ss'")
+    print("To view student information, press 'vs'")
+    print("To modify student information, press 'ms'")
+    print("To delete a student, press 'ds'")
+    print("To search students and lessons by name, press 'se'")
+    print("=== Lesson-related operation ===")
+    print("To add a lesson, press 'al'")
+    print("To view lessons list, press 'vl'")
+    print("To modify lesson information, press 'ml'")
+    print("To assign lessons to student, press 'als'")
+    print("To delete a lesson, press 'dl'")
+    print("=== To show query statistics, press 'qs' ===")
+    print("=== To show this menu again, press 'h' ===")
+    print("=== To exit, press 'e' ===")
+
+# Run one command given on the command line. Returns the process exit status.
+def run_command(args):
+    if args.command == "import":
+        return 0 if run_bulk_import(args.file, args.batch_size, args.reject_file) else 1
+    elif args.command == "check-indexes":
+        return 0 if show_query_plans() else 1
+    elif args.command == "delete-students":
+        return 0 if run_bulk_delete(args.ids, args.grade, args.enrolled_from, args.enrolled_to, args.yes) else 1
+    elif args.command == "search":
+        search_by_name(args.text, args.limit)
+    elif args.command == "report":
+        return 0 if show_report(args.name, args.format, args.output, args.live) else 1
+    elif args.command == "maintenance":
+        return 0 if show_maintenance() else 1
+    elif args.command == "backup":
+        return 0 if run_backup(args.file, args.pages, args.sleep, args.compress) else 1
+    elif args.command == "restore":
+        return 0 if run_restore(args.file, args.pages, args.yes) else 1
+    elif args.command == "changes":
+        return 0 if run_change_export(args.after, args.consumer, args.output, args.limit) else 1
+    elif args.command == "prune-changes":
+        return 0 if run_change_prune(args.through, args.remove_consumer) else 1
+    elif args.command == "federated":
+        return 0 if run_federated(args.operation, args.databases, args.id, args.workers) else 1
+    elif args.command == "batch":
+        if args.file == "-":
+            return 0 if run_batch(sys.stdin) else 1
+        with open(args.file, encoding='utf-8') as file:
+            return 0 if run_batch(file) else 1
+    elif args.command in OPERATION_COMMANDS:
+        try:
+            run_operation(get_connection(), args)
+        except ValueError as e:
+            print(e)
+            return 1
+    return 0
+
 # Main function to run the program
-def main():
+def main(argv=None):
+    args = parse_args(argv)
+    configure_database(args.db, args.profile)
+    if args.query_stats or args.stats_json:
+        enable_query_stats(args.slow_ms, args.slow_log)
     try:
+        # Federated queries only read the files given to them
+        if args.command == "federated":
+            return run_command(args)
         create_tables()
+        if args.command is not None:
+            return run_command(args)
+        # The menu is printed once; 'h' shows it again
+        print_menu()
         while True:
-            print("\n ***** Welcome to School Database CLI Program *****")
-            print("Please choose the operation you want to perform:")
-            print("=== Student-related operation ===")
-            print("To add a student, press 'as'")
-            print("To show the list of all students, press 'ss'")
-            print("To view student information, press 'vs'")
-            print("To modify student information, press 'ms'")
-            print("To delete a student, press 'ds'")
-            print("=== Lesson-related operation ===")
-            print("To add a lesson, press 'al'")
-            print("To view lessons list, press 'vl'")
-            print("To modify lesson information, press 'ml'")
-            print("To assign lessons to student, press 'als'")
-            print("To delete a lesson, press 'dl'")
-            print("=== To exit, press 'e' ===")
-
-            choice = input("Your choice: ").lower()
-
-            if choice == 'as':
+            choice = input("\nYour choice ('h' for the menu): ").lower()
+
+            if choice == 'h':
+                print_menu()
+            elif choice == 'as':
                 add_student()
             elif choice == 'ss':
-                list_students()
+                list_students(args.page_size)
             elif choice == 'vs':
                 display_student()
             elif choice == 'ms':
                 modify_student()
             elif choice == 'ds':
                 delete_student()
+            elif choice == 'se':
+                search_by_name()
             elif choice == 'al':
                 add_lesson()
             elif choice == 'vl':
@@ -474,14 +3016,22 @@ def main():
                 assign_lessons()
             elif choice == 'dl':
                 delete_lesson()
+            elif choice == 'qs':
+                show_query_stats()
             elif choice == 'e':
+                stats = profile_cache.stats()
+                if stats["hits"] or stats["misses"]:
+                    print(f"Student profile cache: {stats['hits']} hits, {stats['misses']} misses.")
                 print("Exiting program...")
                 break
             else:
                 print("Invalid choice! Please try again.")
+        return 0
     finally:
         # Ensure the database connection is closed properly when the program is about to exit
-        conn.close()
+        close_connection()
+        if args.stats_json and query_stats is not None:
+            query_stats.dump(args.stats_json)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())